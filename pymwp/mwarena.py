@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+import sys
+from array import array
+from .mwparser import WikiTree
+from .mwparser import WikiTextParser
+
+
+##  WikiArena
+##
+##  Keeps all the nodes of a parse tree in flat arrays.
+##  Each node has a kind, a parent, a first child, a next sibling,
+##  its number of children and its last child.
+##  Text is joined into a single UTF-8 string and each node has a span
+##  of it: a text node is the text itself, and a tree node covers
+##  all the text below it. (UTF-8 because one non-BMP character would
+##  make a str of the whole page four bytes per character.)
+##  Tokens and the token/xml of a tree are kept in a list.
+##
+class WikiArena:
+
+    TEXT = 0
+    TOKEN = 1
+
+    def __init__(self):
+        self.kinds = array('b')
+        self.parents = array('i')
+        self.children = array('i')
+        self.siblings = array('i')
+        self.counts = array('i')
+        self.lasts = array('i')
+        self.starts = array('i')
+        self.ends = array('i')
+        self.values = array('i')
+        self.objs = []
+        self.klasses = []
+        self.text = None
+        self._kinds = {}
+        self._text = bytearray()
+        return
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def _add(self, kind, parent, start, end, value):
+        i = len(self.kinds)
+        self.kinds.append(kind)
+        self.parents.append(parent)
+        self.children.append(-1)
+        self.siblings.append(-1)
+        self.counts.append(0)
+        self.lasts.append(-1)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.values.append(value)
+        if 0 <= parent:
+            last = self.lasts[parent]
+            if last == -1:
+                self.children[parent] = i
+            else:
+                self.siblings[last] = i
+            self.lasts[parent] = i
+            self.counts[parent] += 1
+        return i
+
+    def _add_obj(self, obj):
+        if obj is None: return -1
+        self.objs.append(obj)
+        return len(self.objs)-1
+
+    def add_text(self, parent, text):
+        text = text.encode('utf-8', 'surrogatepass')
+        last = self.lasts[parent]
+        if (last != -1 and
+            self.kinds[last] == self.TEXT and
+            self.ends[last] == len(self._text)):
+            self.ends[last] += len(text)
+        else:
+            n = len(self._text)
+            self._add(self.TEXT, parent, n, n+len(text), -1)
+        self._text += text
+        return
+
+    def add_token(self, parent, token):
+        self._add(self.TOKEN, parent, 0, 0, self._add_obj(token))
+        return
+
+    def start_tree(self, parent, tree):
+        klass = tree.__class__
+        kind = self._kinds.get(klass)
+        if kind is None:
+            kind = len(self.klasses)+2
+            self._kinds[klass] = kind
+            self.klasses.append(klass)
+        name = _objnames.get(klass)
+        if name is None:
+            name = _objnames[klass] = _get_objname(tree)
+        obj = getattr(tree, name) if name else None
+        n = len(self._text)
+        return self._add(kind, parent, n, n, self._add_obj(obj))
+
+    def end_tree(self, i):
+        self.ends[i] = len(self._text)
+        return
+
+    def add_tree(self, parent, tree):
+        i = self.start_tree(parent, tree)
+        self.add_children(i, tree)
+        self.end_tree(i)
+        return i
+
+    def add_children(self, i, children):
+        for c in children:
+            if isinstance(c, WikiTree):
+                self.add_tree(i, c)
+            elif isinstance(c, str):
+                self.add_text(i, c)
+            else:
+                self.add_token(i, c)
+        return
+
+    def finish(self):
+        self.text = self._text
+        return
+
+    def get_text(self, i):
+        text = self.text[self.starts[i]:self.ends[i]]
+        return text.decode('utf-8', 'surrogatepass')
+
+    def get_node(self, i):
+        kind = self.kinds[i]
+        if kind == self.TEXT:
+            return self.get_text(i)
+        elif kind == self.TOKEN:
+            return self.objs[self.values[i]]
+        else:
+            klass = _get_view(self.klasses[kind-2])
+            return klass(self, i)
+
+
+##  WikiArenaTree
+##
+##  A view of a tree node in a WikiArena. The view of a node is
+##  an instance of its original class, e.g. isinstance(x, WikiLinkTree)
+##  works. Views are created on each access.
+##
+class WikiArenaTree:
+
+    def __init__(self, arena, index):
+        self.arena = arena
+        self.index = index
+        return
+
+    def __iter__(self):
+        arena = self.arena
+        i = arena.children[self.index]
+        while i != -1:
+            yield arena.get_node(i)
+            i = arena.siblings[i]
+        return
+
+    def __len__(self):
+        return self.arena.counts[self.index]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return list(self)[i]
+        arena = self.arena
+        n = arena.counts[self.index]
+        if i < 0:
+            i += n
+        if not (0 <= i < n):
+            raise IndexError(i)
+        if i == n-1:
+            j = arena.lasts[self.index]
+        else:
+            j = arena.children[self.index]
+            for _ in range(i):
+                j = arena.siblings[j]
+        return arena.get_node(j)
+
+    def get_text(self):
+        return self.arena.get_text(self.index)
+
+    def get_obj(self):
+        arena = self.arena
+        return arena.objs[arena.values[self.index]]
+
+_objnames = {}
+def _get_objname(tree):
+    # The attribute that holds the token of a tree, if any.
+    for name in ('token', 'xml'):
+        if name in vars(tree):
+            return name
+    return ''
+
+_views = {}
+def _get_view(klass):
+    try:
+        return _views[klass]
+    except KeyError:
+        pass
+    attrs = {}
+    name = _objnames.get(klass)
+    if name:
+        attrs[name] = property(WikiArenaTree.get_obj)
+    view = type(klass.__name__, (WikiArenaTree, klass), attrs)
+    _views[klass] = view
+    return view
+
+
+##  WikiArenaParser
+##
+##  A WikiTextParser that moves finished top-level nodes into
+##  a WikiArena. get_root() returns a view of the root.
+##
+class WikiArenaParser(WikiTextParser):
+
+    def __init__(self, **kwargs):
+        assert kwargs.get('checkpoint_interval') is None
+        WikiTextParser.__init__(self, **kwargs)
+        self.arena = WikiArena()
+        self._arena_root = self.arena.start_tree(-1, self._root)
+        return
+
+    def close(self):
+        WikiTextParser.close(self)
+        self._root.finish()
+        self._move(len(self._root._subtree))
+        self.arena.end_tree(self._arena_root)
+        self.arena.finish()
+        return
+
+    def get_root(self):
+        assert self.arena.text is not None
+        return self.arena.get_node(self._arena_root)
+
+    def _pop_context(self):
+        WikiTextParser._pop_context(self)
+        if len(self._stack) == 1:
+            # The last child might still get more text.
+            self._move(len(self._root._subtree)-1)
+        return
+
+    def _move(self, n):
+        # The last child is never moved before close(), so that
+        # pending text parts stay with it.
+        subtree = self._root._subtree
+        self.arena.add_children(self._arena_root, subtree[:n])
+        del subtree[:n]
+        return
+
+
+# main
+def main(argv):
+    from utils import getfp
+    args = argv[1:] or ['-']
+    for path in args:
+        print(path, file=sys.stderr)
+        (_,fp) = getfp(path)
+        parser = WikiArenaParser()
+        parser.feed_file(fp, blocksize=65536)
+        parser.close()
+        fp.close()
+        arena = parser.arena
+        print(f'{len(arena)} nodes, {len(arena.text)} bytes of text')
+    return
+
+if __name__ == '__main__': sys.exit(main(sys.argv))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+import sys
+import gzip
+import sqlite3
+import hashlib
+from collections import OrderedDict
+from .mwparser import WikiTextParser
+from .mwparser import WikiParseProfile
+from .mwcodec import MAGIC
+from .mwcodec import encode_tree
+from .mwcodec import decode_tree
+
+
+##  WikiParseCache
+##
+##  Parse trees keyed on a hash of the text and the parser
+##  configuration. Encoded trees are kept in memory (LRU, up to
+##  maxbytes) and, if path is given, in an SQLite file.
+##  Parser arguments that do not change the tree (NO_KEY) are
+##  not part of the key. Trees put in the file are committed every
+##  batchsize puts, so a run that is killed keeps most of them.
+##
+class WikiParseCache:
+
+    NO_KEY = ('dfa', 'checkpoint_interval')
+
+    def __init__(self, path=None, maxbytes=64*1024*1024, gzipped=False,
+                 batchsize=1000):
+        self.maxbytes = maxbytes
+        self.gzipped = gzipped
+        self.batchsize = batchsize
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._size = 0
+        self._conn = None
+        self._uncommitted = 0
+        if path is not None:
+            self._conn = sqlite3.connect(path)
+            self._conn.executescript('''
+CREATE TABLE IF NOT EXISTS MWParseCache (
+    Key BLOB PRIMARY KEY,
+    Tree BLOB
+);
+''')
+        return
+
+    def __repr__(self):
+        return (f'<{self.__class__.__name__} hits={self.hits}'
+                f' disk_hits={self.disk_hits} misses={self.misses}>')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return
+
+    def close(self):
+        if self._conn is not None:
+            self.commit()
+            self._conn.close()
+            self._conn = None
+        return
+
+    def commit(self):
+        if self._conn is not None:
+            self._conn.commit()
+            self._uncommitted = 0
+        return
+
+    def get_key(self, text, klass=WikiTextParser, **kwargs):
+        config = [klass.__module__, klass.__qualname__]
+        for (k,v) in sorted(kwargs.items()):
+            if k in self.NO_KEY: continue
+            if isinstance(v, WikiParseProfile):
+                v = (tuple( c.__qualname__ for c in v.keep ),
+                     tuple( c.__qualname__ for c in v.drop ),
+                     tuple(sorted(v.skip_tags)))
+            elif isinstance(v, (set, frozenset)):
+                v = tuple(sorted(v))
+            config.append((k, v))
+        h = hashlib.blake2b(digest_size=16)
+        h.update(MAGIC)
+        h.update(repr(config).encode('utf-8'))
+        h.update(b'\0')
+        h.update(text.encode('utf-8', 'surrogatepass'))
+        return h.digest()
+
+    def get(self, text, klass=WikiTextParser, lazy=False, **kwargs):
+        key = self.get_key(text, klass, **kwargs)
+        data = self._get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        return decode_tree(data, lazy=lazy)
+
+    def put(self, text, tree, klass=WikiTextParser, **kwargs):
+        key = self.get_key(text, klass, **kwargs)
+        self._put(key, encode_tree(tree))
+        return
+
+    def parse(self, text, klass=WikiTextParser, lazy=False, **kwargs):
+        tree = self.get(text, klass, lazy=lazy, **kwargs)
+        if tree is None:
+            parser = klass(**kwargs)
+            parser.feed_text(text)
+            parser.close()
+            tree = parser.get_root()
+            if parser.exceeded is None:
+                self.put(text, tree, klass, **kwargs)
+        return tree
+
+    def _get(self, key):
+        data = self._memory.get(key)
+        if data is not None:
+            self.hits += 1
+            self._memory.move_to_end(key)
+            return data
+        if self._conn is None: return None
+        for (data,) in self._conn.execute(
+                'SELECT Tree FROM MWParseCache WHERE Key = ?;', (key,)):
+            self.disk_hits += 1
+            if self.gzipped:
+                data = gzip.decompress(data)
+            self._add(key, data)
+            return data
+        return None
+
+    def _put(self, key, data):
+        self._add(key, data)
+        if self._conn is not None:
+            if self.gzipped:
+                data = gzip.compress(data)
+            self._conn.execute(
+                'INSERT OR REPLACE INTO MWParseCache VALUES (?,?);',
+                (key, data))
+            self._uncommitted += 1
+            if self.batchsize <= self._uncommitted:
+                self.commit()
+        return
+
+    def _add(self, key, data):
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        if self.maxbytes < len(data): return
+        self._memory[key] = data
+        self._size += len(data)
+        while self.maxbytes < self._size:
+            (_,old) = self._memory.popitem(last=False)
+            self._size -= len(old)
+        return
+
+
+# main
+def main(argv):
+    import getopt
+    from utils import getfp
+    def usage():
+        print(f'usage: {argv[0]} [-o cachefile] [-Z] [file ...]')
+        return 100
+    try:
+        (opts, args) = getopt.getopt(argv[1:], 'o:Z')
+    except getopt.GetoptError:
+        return usage()
+    path = None
+    gzipped = False
+    for (k, v) in opts:
+        if k == '-o': path = v
+        elif k == '-Z': gzipped = True
+    cache = WikiParseCache(path=path, gzipped=gzipped)
+    for path in (args or ['-']):
+        (_,fp) = getfp(path)
+        cache.parse(fp.read())
+        fp.close()
+    cache.close()
+    print(cache)
+    return
+
+if __name__ == '__main__': sys.exit(main(sys.argv))
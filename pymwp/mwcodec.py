@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+import sys
+import marshal
+from array import array
+from .mwtokenizer import ExtensionToken
+from .mwtokenizer import WikiHeadlineToken
+from .mwtokenizer import WikiItemizeToken
+from .mwtokenizer import XMLStartTagToken
+from .mwtokenizer import XMLEndTagToken
+from .mwtokenizer import XMLEmptyTagToken
+from .mwtokenizer import WikiTokenArray
+from .mwparser import WikiTree
+from .mwparser import WikiPageTree
+from .mwparser import WikiArgTree
+from .mwparser import WikiExtensionTree
+from .mwparser import WikiSpanTree
+from .mwparser import WikiDivTree
+from .mwparser import WikiXMLTree
+from .mwparser import WikiXMLParTree
+from .mwparser import WikiXMLTableTree
+from .mwparser import WikiXMLTableRowTree
+from .mwparser import WikiCommentTree
+from .mwparser import WikiSpecialTree
+from .mwparser import WikiKeywordTree
+from .mwparser import WikiLinkTree
+from .mwparser import WikiTableTree
+from .mwparser import WikiTableCaptionTree
+from .mwparser import WikiTableRowTree
+from .mwparser import WikiTableCellTree
+from .mwparser import WikiTableHeaderTree
+from .mwparser import WikiTableDataTree
+from .mwparser import WikiPreTree
+from .mwparser import WikiItemizeTree
+from .mwparser import WikiHeadlineTree
+
+
+##  WikiCodecError
+##
+class WikiCodecError(ValueError): pass
+
+
+##  Tree encoding
+##
+##  A tree is stored in preorder as three streams, marshalled
+##  after a 4-byte header:
+##
+##    codes  one byte per node.
+##    texts  strings: text, token names and attributes.
+##    nums   32-bit little-endian integers: positions and sizes.
+##
+##  Codes:
+##    0..31  a WikiToken constant (WikiTokenArray.TOKENS).
+##    32     WikiHeadlineToken: texts name, nums pos.
+##    33     WikiItemizeToken: texts name, nums pos.
+##    34     ExtensionToken: texts name.
+##    35-37  XMLStartTagToken/XMLEndTagToken/XMLEmptyTagToken:
+##           texts name, nums pos and n, then texts the raw
+##           attributes (n=-1) or n pairs of keys and values.
+##    38     text: texts text.
+##    64+i   a tree of TREES[i]: its token/xml (if any), nums the
+##           number of codes, texts and nums of its children,
+##           and the children.
+##
+##  Constants are stored as indices, so they keep their identity.
+##  The sizes let decode_tree(lazy=True) skip the children of
+##  a tree until they are used.
+##  marshal is used for speed; the format is meant for caches and
+##  IPC, not for archiving.
+##
+MAGIC = b'MWT\x01'
+
+HEADLINE = 32
+ITEMIZE = 33
+EXTENSION = 34
+XML_START = 35
+XML_END = 36
+XML_EMPTY = 37
+TEXT = 38
+TREE = 64
+
+# Append only.
+TREES = (
+    WikiTree,
+    WikiPageTree,
+    WikiArgTree,
+    WikiExtensionTree,
+    WikiSpanTree,
+    WikiDivTree,
+    WikiXMLTree,
+    WikiXMLParTree,
+    WikiXMLTableTree,
+    WikiXMLTableRowTree,
+    WikiCommentTree,
+    WikiSpecialTree,
+    WikiKeywordTree,
+    WikiLinkTree,
+    WikiTableTree,
+    WikiTableCaptionTree,
+    WikiTableRowTree,
+    WikiTableCellTree,
+    WikiTableHeaderTree,
+    WikiTableDataTree,
+    WikiPreTree,
+    WikiItemizeTree,
+    WikiHeadlineTree,
+)
+TREE_CODE = { klass: TREE+i for (i,klass) in enumerate(TREES) }
+TREE_OBJ = tuple(
+    'xml' if issubclass(klass, WikiXMLTree) else
+    'token' if issubclass(klass, (WikiExtensionTree, WikiSpanTree, WikiDivTree)) else
+    None
+    for klass in TREES )
+
+TOKENS = WikiTokenArray.TOKENS
+TOKEN_CODE = { token: i for (i,token) in enumerate(TOKENS) }
+TOKEN_CLASS_CODE = {
+    WikiHeadlineToken: HEADLINE,
+    WikiItemizeToken: ITEMIZE,
+    ExtensionToken: EXTENSION,
+    XMLStartTagToken: XML_START,
+    XMLEndTagToken: XML_END,
+    XMLEmptyTagToken: XML_EMPTY,
+}
+XML_CLASS = {
+    XML_START: XMLStartTagToken,
+    XML_END: XMLEndTagToken,
+    XML_EMPTY: XMLEmptyTagToken,
+}
+
+def _encode_token(codes, texts, nums, t):
+    code = TOKEN_CODE.get(t)
+    if code is not None:
+        codes.append(code)
+        return
+    code = TOKEN_CLASS_CODE.get(t.__class__)
+    if code is None:
+        raise WikiCodecError(f'cannot encode: {t!r}')
+    codes.append(code)
+    texts.append(t.name)
+    if code == EXTENSION:
+        pass
+    elif code < EXTENSION:
+        nums.append(t.pos)
+    else:
+        nums.append(t.pos)
+        if t._rawattrs is not None:
+            nums.append(-1)
+            texts.append(t._rawattrs)
+        elif t._attrs is None:
+            nums.append(0)
+        else:
+            nums.append(len(t._attrs))
+            for (k,v) in t._attrs.items():
+                texts.append(k)
+                texts.append(v)
+    return
+
+def encode_tree(tree):
+    codes = bytearray()
+    texts = []
+    nums = array('i')
+    stack = []
+    it = iter((tree,))
+    while 1:
+        for x in it:
+            code = TOKEN_CODE.get(x)
+            if code is not None:
+                codes.append(code)
+            elif isinstance(x, str):
+                codes.append(TEXT)
+                texts.append(str(x))
+            elif isinstance(x, WikiTree):
+                code = TREE_CODE.get(x.__class__)
+                if code is None:
+                    code = TREE_CODE.get(getattr(x, '_codec_class', None))
+                    if code is None:
+                        raise WikiCodecError(f'cannot encode: {x!r}')
+                codes.append(code)
+                name = TREE_OBJ[code-TREE]
+                if name is not None:
+                    _encode_token(codes, texts, nums, getattr(x, name))
+                nums.extend((0, 0, 0))
+                stack.append((it, len(codes), len(texts), len(nums)))
+                it = iter(x)
+                break
+            else:
+                _encode_token(codes, texts, nums, x)
+        else:
+            if not stack: break
+            (it, c, t, n) = stack.pop()
+            nums[n-3:n] = array('i', (len(codes)-c, len(texts)-t, len(nums)-n))
+    if sys.byteorder != 'little':
+        nums.byteswap()
+    return MAGIC+marshal.dumps((bytes(codes), texts, nums.tobytes()), 4)
+
+def _decode_token(code, texts, nums, t, n):
+    # Returns the token and the next positions of texts and nums.
+    if code < HEADLINE:
+        return (TOKENS[code], t, n)
+    elif code == HEADLINE:
+        return (WikiHeadlineToken(texts[t], nums[n]), t+1, n+1)
+    elif code == ITEMIZE:
+        return (WikiItemizeToken(texts[t], nums[n]), t+1, n+1)
+    elif code == EXTENSION:
+        return (ExtensionToken(texts[t]), t+1, n)
+    elif code in XML_CLASS:
+        (name, pos, size) = (texts[t], nums[n], nums[n+1])
+        t += 1
+        n += 2
+        if size < 0:
+            token = XML_CLASS[code](name, pos, rawattrs=texts[t])
+            t += 1
+        elif size:
+            attrs = dict(zip(texts[t:t+size*2:2], texts[t+1:t+size*2:2]))
+            token = XML_CLASS[code](name, pos, attr=attrs)
+            t += size*2
+        else:
+            token = XML_CLASS[code](name, pos)
+        return (token, t, n)
+    else:
+        raise WikiCodecError(f'invalid code: {code!r}')
+
+def _decode_tree(codes, texts, nums, c, t, n, lazy):
+    # Returns the tree, the positions of its children and their sizes.
+    code = codes[c]
+    try:
+        klass = TREES[code-TREE]
+    except IndexError:
+        raise WikiCodecError(f'invalid code: {code!r}')
+    name = TREE_OBJ[code-TREE]
+    if lazy:
+        klass = _get_lazy(klass)
+    c += 1
+    if name is None:
+        tree = klass()
+    else:
+        (obj, t, n) = _decode_token(codes[c], texts, nums, t, n)
+        c += 1
+        tree = klass(obj)
+    tree._finished = True
+    return (tree, c, t, n+3, nums[n:n+3])
+
+def _decode_children(codes, texts, nums, c, t, n, end, lazy):
+    children = []
+    stack = []
+    while 1:
+        while c < end:
+            code = codes[c]
+            if code < HEADLINE:
+                children.append(TOKENS[code])
+                c += 1
+            elif code == TEXT:
+                children.append(texts[t])
+                c += 1
+                t += 1
+            elif code < TREE:
+                (token, t, n) = _decode_token(code, texts, nums, t, n)
+                children.append(token)
+                c += 1
+            else:
+                (tree, c, t, n, (nc, nt, nn)) = _decode_tree(
+                    codes, texts, nums, c, t, n, lazy)
+                children.append(tree)
+                if lazy:
+                    # Skip the children.
+                    tree._codec = (codes, texts, nums, c, t, n, c+nc)
+                    (c, t, n) = (c+nc, t+nt, n+nn)
+                else:
+                    stack.append((children, end))
+                    (children, end) = (tree._subtree, c+nc)
+        if not stack: break
+        # c is now at the end of the tree.
+        (children, end) = stack.pop()
+    return children
+
+def decode_tree(data, lazy=False):
+    if data[:len(MAGIC)] != MAGIC:
+        raise WikiCodecError('invalid header')
+    (codes, texts, nums) = marshal.loads(data[len(MAGIC):])
+    nums = array('i', nums)
+    if sys.byteorder != 'little':
+        nums.byteswap()
+    if not codes or codes[0] < TREE:
+        raise WikiCodecError('no tree')
+    (tree, c, t, n, (nc, _, _)) = _decode_tree(codes, texts, nums, 0, 0, 0, lazy)
+    if lazy:
+        tree._codec = (codes, texts, nums, c, t, n, c+nc)
+    else:
+        tree._subtree = _decode_children(codes, texts, nums, c, t, n, c+nc, False)
+    return tree
+
+
+##  Lazy trees
+##
+##  Each tree class has a subclass whose _subtree is decoded
+##  on the first access.
+##
+def _lazy_init(self, *args):
+    self._codec_class.__init__(self, *args)
+    del self._subtree
+    return
+
+def _lazy_getattr(self, name):
+    if name != '_subtree':
+        raise AttributeError(name)
+    (codes, texts, nums, c, t, n, end) = self.__dict__.pop('_codec')
+    self._subtree = _decode_children(codes, texts, nums, c, t, n, end, True)
+    return self._subtree
+
+_lazy = {}
+def _get_lazy(klass):
+    try:
+        return _lazy[klass]
+    except KeyError:
+        pass
+    lazy = type(klass.__name__, (klass,), {
+        '_codec_class': klass,
+        '__init__': _lazy_init,
+        '__getattr__': _lazy_getattr,
+    })
+    _lazy[klass] = lazy
+    return lazy
+
+
+# main
+def main(argv):
+    import time
+    from utils import getfp
+    from .mwparser import WikiTextParser
+    args = argv[1:] or ['-']
+    for path in args:
+        print(path, file=sys.stderr)
+        (_,fp) = getfp(path)
+        parser = WikiTextParser()
+        parser.feed_file(fp, blocksize=65536)
+        parser.close()
+        fp.close()
+        t0 = time.time()
+        data = encode_tree(parser.get_root())
+        t1 = time.time()
+        decode_tree(data)
+        t2 = time.time()
+        print(f'{len(data)} bytes, encode {t1-t0:.3f}s, decode {t2-t1:.3f}s')
+    return
+
+if __name__ == '__main__': sys.exit(main(sys.argv))
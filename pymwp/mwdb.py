@@ -4,6 +4,11 @@ import sqlite3
 import io
 import gzip
 from .utils import getfp
+from .mwcodec import encode_tree
+from .mwcodec import decode_tree
+from .mwtemplate import WikiTemplate
+from .mwtemplate import get_template_name
+from .mwtemplate import get_field_name
 
 
 ##  WikiDB
@@ -27,6 +32,41 @@ CREATE TABLE IF NOT EXISTS MWRevision (
     Content BLOB
 );
 CREATE INDEX IF NOT EXISTS MWRevisionPageIdIndex ON MWRevision(PageId);
+
+CREATE TABLE IF NOT EXISTS MWTree (
+    RevId INTEGER PRIMARY KEY,
+    Tree BLOB
+);
+
+CREATE TABLE IF NOT EXISTS MWTemplate (
+    TemplateId INTEGER PRIMARY KEY,
+    PageId INTEGER NOT NULL,
+    RevId INTEGER NOT NULL,
+    Name TEXT NOT NULL,
+    StartPos INTEGER,
+    EndPos INTEGER
+);
+CREATE INDEX IF NOT EXISTS MWTemplateNameIndex ON MWTemplate(Name);
+CREATE INDEX IF NOT EXISTS MWTemplateRevIdIndex ON MWTemplate(RevId);
+
+CREATE TABLE IF NOT EXISTS MWTemplateArg (
+    TemplateId INTEGER NOT NULL,
+    Key TEXT NOT NULL,
+    Value TEXT,
+    PRIMARY KEY (TemplateId, Key)
+);
+CREATE INDEX IF NOT EXISTS MWTemplateArgKeyIndex ON MWTemplateArg(Key);
+
+CREATE TABLE IF NOT EXISTS MWInfobox (
+    PageId INTEGER NOT NULL,
+    RevId INTEGER NOT NULL,
+    Num INTEGER NOT NULL,
+    Name TEXT NOT NULL,
+    Key TEXT NOT NULL,
+    Value TEXT
+);
+CREATE INDEX IF NOT EXISTS MWInfoboxNameIndex ON MWInfobox(Name, Key);
+CREATE INDEX IF NOT EXISTS MWInfoboxRevIdIndex ON MWInfobox(RevId);
 ''')
         return
 
@@ -90,6 +130,117 @@ CREATE INDEX IF NOT EXISTS MWRevisionPageIdIndex ON MWRevision(PageId);
                            (revid, pageid, timestamp, content))
         return
 
+    def get_tree(self, revid, lazy=False):
+        cur = self._conn.cursor()
+        for (data,) in cur.execute(
+                'SELECT Tree FROM MWTree WHERE RevId = ?;',
+                (revid,)):
+            if self.gzipped:
+                data = gzip.decompress(data)
+            return decode_tree(data, lazy=lazy)
+        raise KeyError(revid)
+
+    def add_tree(self, revid, tree):
+        data = encode_tree(tree)
+        if self.gzipped:
+            data = gzip.compress(data)
+        self._conn.execute('INSERT OR REPLACE INTO MWTree VALUES (?,?);',
+                           (revid, data))
+        return
+
+    def get_templates(self, revid):
+        cur = self._conn.cursor()
+        templates = []
+        for (templateid,name,start,end) in cur.execute(
+                'SELECT TemplateId,Name,StartPos,EndPos FROM MWTemplate'
+                ' WHERE RevId = ? ORDER BY StartPos;', (revid,)):
+            args = {}
+            named = {}
+            for (key,value) in self._conn.execute(
+                    'SELECT Key,Value FROM MWTemplateArg WHERE TemplateId = ?;',
+                    (templateid,)):
+                if key.isdigit():
+                    args[int(key)] = value
+                else:
+                    named[key] = value
+            # Positional arguments are numbered from 1.
+            if sorted(args) != list(range(1, len(args)+1)):
+                named.update( (str(i),v) for (i,v) in args.items() )
+                args = {}
+            args = [ args[i] for i in sorted(args) ]
+            templates.append(WikiTemplate(name, args, named, start, end))
+        return templates
+
+    def add_templates(self, pageid, revid, timestamp, templates):
+        # Replaces the templates of the revision.
+        self._conn.execute(
+            'DELETE FROM MWTemplateArg WHERE TemplateId IN'
+            ' (SELECT TemplateId FROM MWTemplate WHERE RevId = ?);', (revid,))
+        self._conn.execute('DELETE FROM MWTemplate WHERE RevId = ?;', (revid,))
+        for t in templates:
+            cur = self._conn.execute(
+                'INSERT INTO MWTemplate VALUES (NULL,?,?,?,?,?);',
+                (pageid, revid, t.name, t.start, t.end))
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO MWTemplateArg VALUES (?,?,?);',
+                ( (cur.lastrowid, k, v) for (k,v) in t.get_items() ))
+        return
+
+    def find_templates(self, name, key=None):
+        # Yields (pageid, revid, start, end) of the templates called
+        # name (with an argument key).
+        name = get_template_name(name) or name
+        cur = self._conn.cursor()
+        if key is None:
+            rows = cur.execute(
+                'SELECT PageId,RevId,StartPos,EndPos FROM MWTemplate'
+                ' WHERE Name = ?;', (name,))
+        else:
+            # CROSS JOIN makes SQLite look up the name first.
+            rows = cur.execute(
+                'SELECT T.PageId,T.RevId,T.StartPos,T.EndPos'
+                ' FROM MWTemplate T CROSS JOIN MWTemplateArg A'
+                ' ON A.TemplateId = T.TemplateId'
+                ' WHERE T.Name = ? AND A.Key = ?;', (name, key))
+        for row in rows:
+            yield row
+        return
+
+    def get_infoboxes(self, revid):
+        cur = self._conn.cursor()
+        infoboxes = []
+        last = None
+        for (num,name,key,value) in cur.execute(
+                'SELECT Num,Name,Key,Value FROM MWInfobox'
+                ' WHERE RevId = ? ORDER BY Num,rowid;', (revid,)):
+            if num != last:
+                infoboxes.append((name, []))
+                last = num
+            infoboxes[-1][1].append((key, value))
+        return infoboxes
+
+    def add_infoboxes(self, pageid, revid, timestamp, infoboxes):
+        # Replaces the infoboxes of the revision.
+        # infoboxes is [(name, [(key, value), ...]), ...].
+        self._conn.execute('DELETE FROM MWInfobox WHERE RevId = ?;', (revid,))
+        self._conn.executemany(
+            'INSERT INTO MWInfobox VALUES (?,?,?,?,?,?);',
+            ( (pageid, revid, num, name, k, v)
+              for (num,(name,items)) in enumerate(infoboxes)
+              for (k,v) in items ))
+        return
+
+    def find_infoboxes(self, name, key):
+        # Yields (pageid, revid, value) of the field key
+        # of the infoboxes called name.
+        name = get_template_name(name) or name
+        cur = self._conn.cursor()
+        for row in cur.execute(
+                'SELECT PageId,RevId,Value FROM MWInfobox'
+                ' WHERE Name = ? AND Key = ?;', (name, get_field_name(key))):
+            yield row
+        return
+
 
 ##  WikiFileWriter
 ##
@@ -139,6 +290,17 @@ class WikiFileWriter:
             self._fp.write(content+'\n')
         return
 
+    def add_templates(self, pageid, revid, timestamp, templates):
+        # One line per template: name, span and arguments.
+        lines = []
+        for t in templates:
+            fields = [t.name, f'{t.start}:{t.end}']
+            for (k,v) in t.get_items():
+                fields.append(k+'='+' '.join(v.split()))
+            lines.append('\t'.join(fields))
+        self.add_content(pageid, revid, timestamp, '\n'.join(lines))
+        return
+
 
 # main
 def main(argv):
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 import sys
+import time
 from .mwtokenizer import WikiToken
 from .mwtokenizer import ExtensionToken
 from .mwtokenizer import WikiHeadlineToken
@@ -15,11 +16,39 @@ from .mwtokenizer import WikiTextTokenizer
 class WikiParserError(ValueError): pass
 class WikiParserStackOverflow(WikiParserError): pass
 
+##  WikiParserLimitExceeded
+##
+##  limit is the name of the WikiTextParser argument (maxtokens,
+##  maxnodes or maxtime) and pos the position of the token where
+##  it was found.
+##
+class WikiParserLimitExceeded(WikiParserError):
+
+    def __init__(self, limit, pos):
+        WikiParserError.__init__(self, limit, pos)
+        self.limit = limit
+        self.pos = pos
+        return
+
 
 ##  WikiTree
 ##
+##  get_text() is cached on each finished tree. A tree is finished
+##  when a WikiTextParser closes it (or it is decoded), and is not
+##  changed after that, so no cache has to be dropped. Other trees
+##  can be appended to, but are not cached.
+##  Strings appended in a row are kept in _parts and joined into
+##  the last child when the tree is finished or read.
+##
 class WikiTree:
 
+    _textcache = None
+    _finished = False
+    _parts = None
+    # Set by WikiTextParser for a WikiParseProfile.
+    _leaves = True
+    _outer = None
+
     def __init__(self):
         self._subtree = []
         return
@@ -28,37 +57,85 @@ class WikiTree:
         return f'<{self.__class__.__name__}>'
 
     def __iter__(self):
+        if self._parts is not None: self._join_parts()
         return iter(self._subtree)
 
     def __len__(self):
         return len(self._subtree)
 
     def __getitem__(self, i):
+        if self._parts is not None: self._join_parts()
         return self._subtree[i]
 
     def __getslice__(self, i, j):
+        if self._parts is not None: self._join_parts()
         return self._subtree[i:j]
 
     def get_text(self):
-        s = ''
-        for x in self:
-            if isinstance(x, WikiTree):
-                s += x.get_text()
-            elif isinstance(x, str):
-                s += x
-        return s
+        text = self._textcache
+        if text is not None:
+            return text
+        parts = []
+        stack = []
+        it = iter(self)
+        while 1:
+            for x in it:
+                if isinstance(x, str):
+                    parts.append(x)
+                elif isinstance(x, WikiTree):
+                    text = x._textcache
+                    if text is not None:
+                        parts.append(text)
+                    else:
+                        stack.append(it)
+                        it = iter(x)
+                        break
+            else:
+                if not stack: break
+                it = stack.pop()
+        text = ''.join(parts)
+        if self._finished:
+            self._textcache = text
+        return text
+
+    def _get_mark(self):
+        if self._parts is not None: self._join_parts()
+        if self._subtree:
+            return (len(self._subtree), self._subtree[-1])
+        else:
+            return (0, None)
+
+    def _rewind(self, mark):
+        self._textcache = None
+        (n, last) = mark
+        self._parts = None
+        del self._subtree[n:]
+        if n:
+            self._subtree[n-1] = last
+        return
 
     def append(self, t):
+        assert not self._finished, 'finished tree'
         if (self._subtree and
             isinstance(t, str) and
             isinstance(self._subtree[-1], str)):
             assert type(t) is type(self._subtree[-1]), (t, self._subtree[-1])
-            self._subtree[-1] += t
+            if self._parts is None:
+                self._parts = [self._subtree[-1]]
+            self._parts.append(t)
         else:
+            if self._parts is not None: self._join_parts()
             self._subtree.append(t)
         return
 
+    def _join_parts(self):
+        last = self._subtree[-1]
+        self._subtree[-1] = type(last)(''.join(self._parts))
+        self._parts = None
+        return
+
     def finish(self):
+        if self._parts is not None: self._join_parts()
         return
 
 class WikiPageTree(WikiTree): pass
@@ -112,76 +189,351 @@ class WikiItemizeTree(WikiDivTree): pass
 class WikiHeadlineTree(WikiDivTree): pass
 
 
+##  WikiParseProfile
+##
+##  Tells WikiTextParser which trees to build.
+##  keep: trees built with all their content. Outside of them,
+##    trees and text are parsed but not kept, and kept trees found
+##    there are added to the nearest kept tree (usually the root).
+##  drop: trees thrown away with all their content.
+##  skip_tags: XML elements not parsed at all (see WikiTextTokenizer).
+##
+class WikiParseProfile:
+
+    PASS = 0
+    KEEP = 1
+    DROP = 2
+
+    def __init__(self, keep=(WikiTree,), drop=(), skip_tags=()):
+        self.keep = tuple(keep)
+        self.drop = tuple(drop)
+        self.skip_tags = skip_tags
+        self._modes = {}
+        return
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} keep={self.keep} drop={self.drop}>'
+
+    def get_mode(self, tree):
+        klass = tree.__class__
+        try:
+            return self._modes[klass]
+        except KeyError:
+            pass
+        if isinstance(tree, self.drop):
+            mode = self.DROP
+        elif isinstance(tree, self.keep):
+            mode = self.KEEP
+        else:
+            mode = self.PASS
+        self._modes[klass] = mode
+        return mode
+
+WikiParseProfile.LINKS = WikiParseProfile(
+    keep=(WikiKeywordTree, WikiLinkTree))
+WikiParseProfile.CATEGORIES = WikiParseProfile(
+    keep=(WikiKeywordTree,))
+WikiParseProfile.NO_TABLES = WikiParseProfile(
+    drop=(WikiTableTree, WikiXMLTableTree))
+
+
 ##  WikiTextParser
 ##
+##  Limits per page (None for no limit):
+##    maxdepth: trees open at a time (WikiParserStackOverflow).
+##    maxtokens: tokens and texts parsed.
+##    maxnodes: trees made.
+##    maxtime: seconds since the parser was made, checked every
+##      TIME_CHECK tokens.
+##  The last three raise WikiParserLimitExceeded, or if degrade is
+##  true, close the open trees and add the rest of the page to the
+##  root as one text without parsing it. exceeded is then set to
+##  the error.
+##
 class WikiTextParser(WikiTextTokenizer):
 
-    def __init__(self, maxdepth=100):
-        WikiTextTokenizer.__init__(self)
+    # XML elements open in the current context, up to the nearest
+    # table (for rows and paragraphs) or row (for paragraphs).
+    XML_TABLE = 1
+    XML_TABLEROW = 2
+    XML_PAR = 4
+
+    TIME_CHECK = 1024
+
+    def __init__(self, maxdepth=100, profile=None, maxtokens=None,
+                 maxnodes=None, maxtime=None, degrade=False, **kwargs):
+        if profile is not None and profile.skip_tags:
+            kwargs['skip_tags'] = (
+                tuple(kwargs.get('skip_tags', ())) + tuple(profile.skip_tags))
+        WikiTextTokenizer.__init__(self, **kwargs)
         self.maxdepth = maxdepth
+        self.profile = profile
+        self.maxtokens = maxtokens
+        self.maxnodes = maxnodes
+        self.maxtime = maxtime
+        self.degrade = degrade
+        self.exceeded = None
+        self._tokens = 0
+        self._nodes = 0
+        self._deadline = None
+        if maxtime is not None:
+            self._deadline = time.monotonic() + maxtime
+        # The rest of the page after a limit is exceeded.
+        self._flat = None
+        # Inputs since the start (or the last checkpoint restored)
+        # for degrade, as a token can start in an earlier one.
+        self._fed = None
+        if (maxtokens is not None or maxnodes is not None or
+            maxtime is not None):
+            # Limits are looked at when _tokens reaches _next_check.
+            self._next_check = 0
+            self._maxnodes = maxnodes if maxnodes is not None else sys.maxsize
+            self.feed_token = self._feed_token_limited
+            if degrade:
+                self._fed = []
         self._tree = self._root = WikiPageTree()
+        if profile is not None:
+            # _outer is where kept trees go, _leaves where the rest goes.
+            mode = profile.get_mode(self._root)
+            assert mode != profile.DROP
+            self._root._outer = self._root
+            self._root._leaves = (mode == profile.KEEP)
         self._parse = self._parse_top
         self._stoptokens = None
-        self._xmlcontext = []
+        self._xmlcontext = 0
         self._stack = [(self._tree, self._parse, self._stoptokens, self._xmlcontext)]
         return
 
     def get_root(self):
         return self._root
 
+    def feed_text(self, text):
+        if self._flat is not None:
+            self._flat.append(text)
+            return
+        if self._fed is not None:
+            self._fed.append(text)
+        try:
+            WikiTextTokenizer.feed_text(self, text)
+        except WikiParserLimitExceeded as e:
+            if not self.degrade: raise
+            self._pos += len(text)
+            self._flatten(e)
+        return
+
+    def close(self):
+        if self._flat is None:
+            try:
+                WikiTextTokenizer.close(self)
+            except WikiParserLimitExceeded as e:
+                if not self.degrade: raise
+                self._flatten(e)
+        if self._flat:
+            text = ''.join(self._flat)
+            self._flat = []
+            if text:
+                self._append(text)
+        # Trees left open are done.
+        for (tree,_,_,_) in self._stack:
+            tree._finished = True
+        return
+
     def feed_token(self, pos, token):
         while 1:
             #print(token, self._parse)
             if self._parse(pos, token): break
         return
 
+    def _feed_token_limited(self, pos, token):
+        self._tokens += 1
+        if self._next_check <= self._tokens or self._maxnodes < self._nodes:
+            self._check_limits(pos)
+        WikiTextParser.feed_token(self, pos, token)
+        return
+
+    def _check_limits(self, pos):
+        if self.maxnodes is not None and self.maxnodes < self._nodes:
+            raise WikiParserLimitExceeded('maxnodes', pos)
+        if self.maxtokens is not None and self.maxtokens < self._tokens:
+            raise WikiParserLimitExceeded('maxtokens', pos)
+        if self._deadline is not None and self._deadline < time.monotonic():
+            raise WikiParserLimitExceeded('maxtime', pos)
+        n = sys.maxsize
+        if self.maxtokens is not None:
+            n = self.maxtokens+1
+        if self._deadline is not None:
+            n = min(n, self._tokens+self.TIME_CHECK)
+        self._next_check = n
+        return
+
+    def _flatten(self, e):
+        # Keeps the text from where the limit was exceeded.
+        self.exceeded = e
+        while 1 < len(self._stack):
+            self._pop_context()
+        text = ''.join(self._fed)
+        start = self._pos - len(text)
+        self._flat = [text[max(0, e.pos-start):]]
+        self._fed = None
+        return
+
     def handle_token(self, pos, token):
         WikiTextTokenizer.handle_token(self, pos, token)
+        if (token is WikiToken.BLANK and not self._tree._leaves and
+            self._parse.__func__ in self.BLANK_STATES):
+            # Not kept by the profile.
+            return
         self.feed_token(pos, token)
         return
 
     def handle_text(self, pos, text):
         WikiTextTokenizer.handle_text(self, pos, text)
+        if (not self._tree._leaves and
+            self._parse.__func__ in self.TEXT_STATES):
+            # Not kept by the profile.
+            return
         self.feed_token(pos, text)
         return
 
+    def _save_state(self):
+        marks = [ tree._get_mark() for (tree,_,_,_) in self._stack ]
+        return (WikiTextTokenizer._save_state(self), list(self._stack), marks)
+
+    def _restore_state(self, state):
+        (base, stack, marks) = state
+        WikiTextTokenizer._restore_state(self, base)
+        for ((tree,_,_,_), mark) in zip(stack, marks):
+            tree._rewind(mark)
+            tree._finished = False
+        self._stack = list(stack)
+        (self._tree, self._parse, self._stoptokens, self._xmlcontext) = self._stack[-1]
+        if self._fed is not None:
+            # Nothing before a checkpoint is pending.
+            self._fed = []
+        return
+
+    def _at_top(self):
+        # True if nothing is open at the beginning of a line.
+        return (self._flat is None and len(self._stack) == 1 and
+                WikiTextTokenizer._at_bol(self))
+
     def invalid_token(self, pos, token):
         print(self._parse, pos, token, file=sys.stderr)
         return
 
+    def _append(self, t):
+        if self._tree._leaves:
+            self._tree.append(t)
+        return
+
+    def _append_tree(self, t):
+        profile = self.profile
+        parent = self._tree
+        if profile is None:
+            parent.append(t)
+            return
+        mode = profile.get_mode(t)
+        if parent._outer is None or mode == profile.DROP:
+            # Dropped with its content.
+            t._outer = None
+            t._leaves = False
+        elif parent._leaves or mode == profile.KEEP:
+            parent._outer.append(t)
+            t._outer = t
+            t._leaves = True
+        else:
+            # Not kept, but might have kept trees inside.
+            t._outer = parent._outer
+            t._leaves = False
+        return
+
     def _push_context(self, tree, parse, stoptokens=None, xmlcontext=None):
         if self.maxdepth <= len(self._stack): raise WikiParserStackOverflow
-        self._tree.append(tree)
+        self._nodes += 1
+        self._append_tree(tree)
         self._tree = tree
         self._parse = parse
         self._stoptokens = stoptokens
         if xmlcontext is not None:
-            self._xmlcontext = [xmlcontext]+self._xmlcontext
+            # A table clears everything inside, a row clears paragraphs.
+            self._xmlcontext = (self._xmlcontext & (xmlcontext-1)) | xmlcontext
         self._stack.append((self._tree, self._parse, self._stoptokens, self._xmlcontext))
         return
 
     def _pop_context(self):
         assert self._stack
         self._tree.finish()
+        self._tree._finished = True
         self._stack.pop()
         (self._tree, self._parse, self._stoptokens, self._xmlcontext) = self._stack[-1]
         return
 
     def _is_xml_closing(self, t):
-        def getuntil(*names):
-            for name in self._xmlcontext:
-                if name in names: break
-                yield name
-            return
-        if isinstance(t, XMLEndTagToken) and t.name in XMLTagToken.TABLE_TAG:
-            return 'table' in self._xmlcontext
-        elif isinstance(t, XMLTagToken) and t.name in XMLTagToken.TABLE_ROW_TAG:
-            return 'tablerow' in getuntil('table')
-        elif isinstance(t, XMLTagToken) and t.name in XMLTagToken.PAR_TAG:
-            return 'par' in getuntil('tablerow','table')
+        if not isinstance(t, XMLTagToken):
+            return False
+        elif isinstance(t, XMLEndTagToken) and t.name in XMLTagToken.TABLE_TAG:
+            return bool(self._xmlcontext & self.XML_TABLE)
+        elif t.name in XMLTagToken.TABLE_ROW_TAG:
+            return bool(self._xmlcontext & self.XML_TABLEROW)
+        elif t.name in XMLTagToken.PAR_TAG:
+            return bool(self._xmlcontext & self.XML_PAR)
         else:
             return False
 
+    # Tokens that end a state, mapped to whether the token is
+    # consumed (True) or passed on to the outer state (False).
+    TABLE_TOKENS = (
+        WikiToken.TABLE_CLOSE,
+        WikiToken.TABLE_CAPTION,
+        WikiToken.TABLE_ROW,
+        WikiToken.TABLE_HEADER,
+        WikiToken.TABLE_HEADER_SEP,
+        WikiToken.TABLE_DATA,
+        WikiToken.TABLE_DATA_SEP)
+    END_TABLE_CELL = dict.fromkeys(TABLE_TOKENS, False)
+    END_TABLE_CELL[WikiToken.EOL] = True
+    END_TABLE_ARG = dict(END_TABLE_CELL)
+    END_TABLE_ARG[WikiToken.BAR] = True
+    END_XML = frozenset(TABLE_TOKENS)
+
+    # Tokens that start a tree: (tree class, parse state).
+    PAR_PUSH = {
+        WikiItemizeToken: (WikiItemizeTree, '_parse_itemize'),
+        WikiHeadlineToken: (WikiHeadlineTree, '_parse_headline'),
+        WikiToken.PRE: (WikiPreTree, '_parse_pre'),
+        WikiToken.TABLE_OPEN: (WikiTableTree, '_parse_table'),
+    }
+    BASE_PUSH = {
+        WikiToken.SPECIAL_OPEN: (WikiSpecialTree, '_parse_special'),
+        WikiToken.KEYWORD_OPEN: (WikiKeywordTree, '_parse_keyword'),
+        WikiToken.LINK_OPEN: (WikiLinkTree, '_parse_link'),
+        WikiToken.QUOTE2: (WikiSpanTree, '_parse_span'),
+        WikiToken.QUOTE3: (WikiSpanTree, '_parse_span'),
+        WikiToken.QUOTE5: (WikiSpanTree, '_parse_span'),
+        WikiToken.COMMENT_OPEN: (WikiCommentTree, '_parse_comment'),
+    }
+    TABLE_PUSH = {
+        WikiToken.TABLE_CAPTION: (WikiTableCaptionTree, '_parse_table_caption'),
+        WikiToken.TABLE_ROW: (WikiTableRowTree, '_parse_table_row'),
+    }
+    TABLE_ROW_PUSH = {
+        WikiToken.TABLE_HEADER: (WikiTableHeaderTree, '_parse_table_header'),
+        WikiToken.TABLE_HEADER_SEP: (WikiTableHeaderTree, '_parse_table_header'),
+        WikiToken.TABLE_DATA: (WikiTableDataTree, '_parse_table_data'),
+        WikiToken.TABLE_DATA_SEP: (WikiTableDataTree, '_parse_table_data'),
+    }
+    END_TABLE_ROW = {
+        WikiToken.EOL: True,
+        WikiToken.TABLE_CLOSE: False,
+        WikiToken.TABLE_CAPTION: False,
+        WikiToken.TABLE_ROW: False,
+    }
+
+    def _push_token(self, push, t):
+        (klass, parse) = push
+        self._push_context(klass(t), getattr(self, parse))
+        return
+
     # _parse_top: initial state.
     def _parse_top(self, pos, t):
         if isinstance(t, ExtensionToken):
@@ -193,22 +545,12 @@ class WikiTextParser(WikiTextTokenizer):
 
     # _parse_par: beginning of paragraph.
     def _parse_par(self, pos, t):
-        if t in (
-            WikiToken.HR,
-            WikiToken.PAR):
-            self._tree.append(t)
-            return True
-        elif isinstance(t, WikiItemizeToken):
-            self._push_context(WikiItemizeTree(t), self._parse_itemize)
-            return True
-        elif isinstance(t, WikiHeadlineToken):
-            self._push_context(WikiHeadlineTree(t), self._parse_headline)
-            return True
-        elif t is WikiToken.PRE:
-            self._push_context(WikiPreTree(t), self._parse_pre)
+        if t is WikiToken.HR or t is WikiToken.PAR:
+            self._append(t)
             return True
-        elif t is WikiToken.TABLE_OPEN:
-            self._push_context(WikiTableTree(t), self._parse_table)
+        push = self.PAR_PUSH.get(t) or self.PAR_PUSH.get(t.__class__)
+        if push is not None:
+            self._push_token(push, t)
             return True
         else:
             return self._parse_base(pos, t)
@@ -250,26 +592,19 @@ class WikiTextParser(WikiTextTokenizer):
     # _parse_table: {| ...
     def _parse_table(self, pos, t):
         assert isinstance(self._tree, WikiTableTree), self._tree
-        if self._is_xml_closing(t):
+        if self._xmlcontext and self._is_xml_closing(t):
             self._pop_context()
             return False
         elif t is WikiToken.TABLE_CLOSE:
             # End of table.
             self._pop_context()
             return True
-        elif t is WikiToken.TABLE_CAPTION:
-            # Start of table caption.
-            self._push_context(WikiTableCaptionTree(t), self._parse_table_caption)
-            return True
-        elif t is WikiToken.TABLE_ROW:
-            # Start of table row.
-            self._push_context(WikiTableRowTree(t), self._parse_table_row)
+        push = self.TABLE_PUSH.get(t)
+        if push is not None:
+            # Start of table caption or row.
+            self._push_token(push, t)
             return True
-        elif t in (
-                WikiToken.TABLE_HEADER,
-                WikiToken.TABLE_HEADER_SEP,
-                WikiToken.TABLE_DATA,
-                WikiToken.TABLE_DATA_SEP):
+        elif t in self.TABLE_ROW_PUSH:
             # FAILSAFE: missing table row token.
             self._push_context(WikiTableRowTree(t), self._parse_table_row)
             return False
@@ -278,194 +613,95 @@ class WikiTextParser(WikiTextTokenizer):
             self._push_context(WikiArgTree(), self._parse_table_arg)
             return False
 
-    # _parse_table_caption: |+ ...
-    def _parse_table_caption(self, pos, t):
-        assert isinstance(self._tree, WikiTableCaptionTree), self._tree
-        if self._is_xml_closing(t):
+    # _parse_table_cell: common part of the table states.
+    def _parse_table_cell(self, pos, t, ends):
+        if self._xmlcontext and self._is_xml_closing(t):
             self._pop_context()
             return False
-        elif t is WikiToken.EOL:
-            # End of table caption.
+        end = ends.get(t)
+        if end is not None:
+            # End of table cell, or FAILSAFE: missing tokens.
             self._pop_context()
-            return True
-        elif t in (
-                WikiToken.TABLE_CLOSE,
-                WikiToken.TABLE_CAPTION,
-                WikiToken.TABLE_ROW,
-                WikiToken.TABLE_HEADER,
-                WikiToken.TABLE_HEADER_SEP,
-                WikiToken.TABLE_DATA,
-                WikiToken.TABLE_DATA_SEP):
-            # FAILSAFE: missing tokens.
-            self._pop_context()
-            return False
+            return end
         else:
             # Anything else is table argument.
             self._push_context(WikiArgTree(), self._parse_table_arg)
             return False
 
+    # _parse_table_caption: |+ ...
+    def _parse_table_caption(self, pos, t):
+        assert isinstance(self._tree, WikiTableCaptionTree), self._tree
+        return self._parse_table_cell(pos, t, self.END_TABLE_CELL)
+
     # _parse_table_row: |- ...
     def _parse_table_row(self, pos, t):
         assert isinstance(self._tree, WikiTableRowTree), self._tree
-        if self._is_xml_closing(t):
-            self._pop_context()
-            return False
-        elif t is WikiToken.EOL:
-            # End of table row.
-            self._pop_context()
-            return True
-        elif t in (
-                WikiToken.TABLE_HEADER,
-                WikiToken.TABLE_HEADER_SEP):
-            # Start of table header.
-            self._push_context(WikiTableHeaderTree(t), self._parse_table_header)
+        push = self.TABLE_ROW_PUSH.get(t)
+        if push is not None:
+            # Start of table header or data.
+            self._push_token(push, t)
             return True
-        elif t in (
-                WikiToken.TABLE_DATA,
-                WikiToken.TABLE_DATA_SEP):
-            # Start of table data.
-            self._push_context(WikiTableDataTree(t), self._parse_table_data)
-            return True
-        elif t in (
-                WikiToken.TABLE_CLOSE,
-                WikiToken.TABLE_CAPTION,
-                WikiToken.TABLE_ROW):
-            # FAILSAFE: missing tokens.
-            self._pop_context()
-            return False
         else:
-            # Anything else is table argument.
-            self._push_context(WikiArgTree(), self._parse_table_arg)
-            return False
+            # End of table row, or FAILSAFE: missing tokens.
+            return self._parse_table_cell(pos, t, self.END_TABLE_ROW)
 
     # _parse_table_header: ! ... !! ...
     def _parse_table_header(self, pos, t):
         assert isinstance(self._tree, WikiTableHeaderTree), self._tree
-        if self._is_xml_closing(t):
-            self._pop_context()
-            return False
-        elif t is WikiToken.EOL:
-            # End of table header.
-            self._pop_context()
-            return True
-        elif t is WikiToken.TABLE_HEADER_SEP:
-            # Next table header.
-            self._pop_context()
-            return False
-        elif t in (
-                WikiToken.TABLE_CLOSE,
-                WikiToken.TABLE_CAPTION,
-                WikiToken.TABLE_ROW,
-                WikiToken.TABLE_HEADER,
-                WikiToken.TABLE_DATA,
-                WikiToken.TABLE_DATA_SEP):
-            # FAILSAFE: missing tokens.
-            self._pop_context()
-            return False
-        else:
-            # Anything else is table argument.
-            self._push_context(WikiArgTree(), self._parse_table_arg)
-            return False
+        return self._parse_table_cell(pos, t, self.END_TABLE_CELL)
 
     # _parse_table_data: | ... || ...
     def _parse_table_data(self, pos, t):
         assert isinstance(self._tree, WikiTableDataTree), self._tree
-        if self._is_xml_closing(t):
-            self._pop_context()
-            return False
-        elif t is WikiToken.EOL:
-            # End of table data.
-            self._pop_context()
-            return True
-        elif t is WikiToken.TABLE_DATA_SEP:
-            # Next table data.
-            self._pop_context()
-            return False
-        elif t in (
-                WikiToken.TABLE_CLOSE,
-                WikiToken.TABLE_CAPTION,
-                WikiToken.TABLE_ROW,
-                WikiToken.TABLE_HEADER,
-                WikiToken.TABLE_HEADER_SEP,
-                WikiToken.TABLE_DATA):
-            # FAILSAFE: missing tokens.
-            self._pop_context()
-            return False
-        else:
-            # Anything else is table argument.
-            self._push_context(WikiArgTree(), self._parse_table_arg)
-            return False
+        return self._parse_table_cell(pos, t, self.END_TABLE_CELL)
 
     # _parse_table_arg:
     def _parse_table_arg(self, pos, t):
         assert isinstance(self._tree, WikiArgTree), self._tree
-        if t is WikiToken.EOL:
-            # End of table argument.
-            self._pop_context()
-            return True
-        elif t is WikiToken.BAR:
-            # Next table argument.
+        end = self.END_TABLE_ARG.get(t)
+        if end is not None:
+            # End of table argument, or FAILSAFE: missing tokens.
             self._pop_context()
-            return True
-        elif t in (
-                WikiToken.TABLE_CLOSE,
-                WikiToken.TABLE_CAPTION,
-                WikiToken.TABLE_ROW,
-                WikiToken.TABLE_HEADER,
-                WikiToken.TABLE_HEADER_SEP,
-                WikiToken.TABLE_DATA,
-                WikiToken.TABLE_DATA_SEP):
-            # FAILSAFE: missing tokens.
-            self._pop_context()
-            return False
+            return end
         else:
             return self._parse_base(pos, t)
 
     # _parse_base: generic parse state.
     def _parse_base(self, pos, t):
-        if self._is_xml_closing(t):
-            self._pop_context()
-            return False
-        elif t is WikiToken.SPECIAL_OPEN:
-            self._push_context(WikiSpecialTree(t), self._parse_special)
-            return True
-        elif t is WikiToken.KEYWORD_OPEN:
-            self._push_context(WikiKeywordTree(t), self._parse_keyword)
-            return True
-        elif t is WikiToken.LINK_OPEN:
-            self._push_context(WikiLinkTree(t), self._parse_link)
-            return True
-        elif t in (
-            WikiToken.QUOTE2,
-            WikiToken.QUOTE3,
-            WikiToken.QUOTE5):
-            self._push_context(WikiSpanTree(t), self._parse_span)
+        klass = t.__class__
+        if klass is str:
+            # text string.
+            self._append(t)
             return True
-        elif t is WikiToken.COMMENT_OPEN:
-            self._push_context(WikiCommentTree(t), self._parse_comment)
+        push = self.BASE_PUSH.get(t)
+        if push is not None:
+            self._push_token(push, t)
             return True
         elif isinstance(t, WikiToken):
             # any unhandled wiki token.
-            self._tree.append(t)
+            self._append(t)
             return True
+        elif self._xmlcontext and self._is_xml_closing(t):
+            self._pop_context()
+            return False
         elif isinstance(t, XMLStartTagToken) and t.name in XMLTagToken.TABLE_TAG:
             self._push_context(WikiXMLTableTree(t), self._parse_xml_table,
-                               xmlcontext='table')
+                               xmlcontext=self.XML_TABLE)
             return True
         elif isinstance(t, XMLStartTagToken) and t.name in XMLTagToken.PAR_TAG:
             self._push_context(WikiXMLParTree(t), self._parse_xml_par,
-                               xmlcontext='par')
+                               xmlcontext=self.XML_PAR)
             return True
         elif isinstance(t, XMLStartTagToken):
             self._push_context(WikiXMLTree(t), self._parse_xml)
             return True
         elif isinstance(t, XMLTagToken):
             # any unhandled XML token.
-            self._tree.append(t)
+            self._append(t)
             return True
         elif isinstance(t, str):
             # text string.
-            self._tree.append(t)
+            self._append(t)
             return True
         else:
             self.invalid_token(pos, t)
@@ -576,7 +812,7 @@ class WikiTextParser(WikiTextTokenizer):
             self._pop_context()
             return True
         else:
-            self._tree.append(t)
+            self._append(t)
             return True
 
     # _parse_xml_table: handle XML table tags.
@@ -591,7 +827,7 @@ class WikiTextParser(WikiTextTokenizer):
               t.name in XMLTagToken.TABLE_ROW_TAG):
             self._push_context(WikiXMLTableRowTree(t),
                                self._parse_xml_table_row,
-                               xmlcontext='tablerow')
+                               xmlcontext=self.XML_TABLEROW)
             # Start <table>.
             return True
         else:
@@ -621,14 +857,7 @@ class WikiTextParser(WikiTextTokenizer):
             # End of XML paragraph.
             self._pop_context()
             return True
-        elif t in (
-                WikiToken.TABLE_CLOSE,
-                WikiToken.TABLE_CAPTION,
-                WikiToken.TABLE_ROW,
-                WikiToken.TABLE_HEADER,
-                WikiToken.TABLE_HEADER_SEP,
-                WikiToken.TABLE_DATA,
-                WikiToken.TABLE_DATA_SEP):
+        elif t in self.END_XML:
             # FAILSAFE: automatically close XML tag before any table token.
             self._pop_context()
             return False
@@ -643,20 +872,21 @@ class WikiTextParser(WikiTextTokenizer):
             # End of XML.
             self._pop_context()
             return True
-        elif t in (
-                WikiToken.TABLE_CLOSE,
-                WikiToken.TABLE_CAPTION,
-                WikiToken.TABLE_ROW,
-                WikiToken.TABLE_HEADER,
-                WikiToken.TABLE_HEADER_SEP,
-                WikiToken.TABLE_DATA,
-                WikiToken.TABLE_DATA_SEP):
+        elif t in self.END_XML:
             # FAILSAFE: automatically close XML tag before any table token.
             self._pop_context()
             return False
         else:
             return self._parse_par(pos, t)
 
+    # States in which text and blanks are only appended to the tree.
+    TEXT_STATES = frozenset((
+        _parse_top, _parse_par, _parse_itemize, _parse_headline,
+        _parse_pre, _parse_table_arg, _parse_span, _parse_arg_barsep,
+        _parse_arg_blanksep, _parse_comment, _parse_xml_table,
+        _parse_xml_table_row, _parse_xml_par, _parse_xml))
+    BLANK_STATES = TEXT_STATES - {_parse_arg_blanksep}
+
 
 # main
 def main(argv):
@@ -666,7 +896,7 @@ def main(argv):
         print(path, file=sys.stderr)
         (_,fp) = getfp(path)
         parser = WikiTextParser()
-        parser.feed_file(fp)
+        parser.feed_file(fp, blocksize=65536)
         parser.close()
         fp.close()
         def f(x, i=0):
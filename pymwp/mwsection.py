@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+import sys
+import re
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from .mwtokenizer import WikiVarToken
+from .mwtokenizer import XMLTagToken
+from .mwparser import WikiTree
+from .mwparser import WikiPageTree
+from .mwparser import WikiTextParser
+from .mwparser import WikiParserError
+from .mwcodec import encode_tree
+from .mwcodec import decode_tree
+
+
+##  WikiSectionParser
+##
+##  Parses successive revisions of a page, reparsing only the
+##  sections that changed since the previous parse().
+##
+##  A page is split before each line that starts with '='. A split
+##  is a section boundary if nothing is open there (see _at_top()),
+##  so that the rest can be parsed with a new parser. Pieces
+##  between other splits stay in the same section. A section whose
+##  text is the same as one of the previous revision is not parsed
+##  again; its trees are reused (copied if its position moved).
+##  The tree returned is the same as that of a full parse.
+##
+class WikiSectionParser:
+
+    SPLIT = re.compile(r'^=', re.M)
+
+    def __init__(self, klass=WikiTextParser, **kwargs):
+        # Positions are absolute, so no checkpoints.
+        assert kwargs.get('checkpoint_interval') is None
+        self.klass = klass
+        self.kwargs = kwargs
+        self.parsed = 0
+        self.reused = 0
+        # {digest of the first piece: [(start, digests, ended, children), ...]}
+        self._sections = {}
+        return
+
+    def __repr__(self):
+        return (f'<{self.__class__.__name__} parsed={self.parsed}'
+                f' reused={self.reused}>')
+
+    def parse(self, text):
+        starts = [0] + [ m.start() for m in self.SPLIT.finditer(text, 1) ]
+        ends = starts[1:] + [len(text)]
+        digests = [ _digest(text[s:e]) for (s,e) in zip(starts, ends) ]
+        n = len(starts)
+        root = WikiPageTree()
+        sections = {}
+        i = 0
+        while i < n:
+            section = self._find(digests, i)
+            if section is None:
+                (j, ended, parser) = _parse_pieces(
+                    self.klass, self.kwargs, text, starts, ends, i)
+                section = (starts[i], tuple(digests[i:j]), ended,
+                           list(parser.get_root()))
+                self.parsed += 1
+            else:
+                (start, ds, ended, children) = section
+                if start != starts[i]:
+                    children = _move(children, starts[i]-start)
+                section = (starts[i], ds, ended, children)
+                self.reused += 1
+            sections.setdefault(digests[i], []).append(section)
+            (_, ds, _, children) = section
+            root._subtree.extend(children)
+            i += len(ds)
+        self._sections = sections
+        return root
+
+    def _find(self, digests, i):
+        n = len(digests)
+        for section in self._sections.get(digests[i], ()):
+            (_, ds, ended, _) = section
+            j = i+len(ds)
+            if (j <= n and tuple(digests[i:j]) == ds and
+                (ended or j == n)):
+                return section
+        return None
+
+
+##  WikiParallelParser
+##
+##  Parses a large page in pieces on a process pool.
+##  The page is cut about every piecesize characters at a blank
+##  line or before a headline, and each piece is parsed by a new
+##  parser at the same time. The trees are sent back encoded (see
+##  mwcodec). A piece is used only if the one before it ended with
+##  nothing open; otherwise that part is parsed again here, into
+##  the following pieces until a boundary is found.
+##  Smaller pages, or all pages if no pool can be started, are
+##  parsed here. The tree returned is the same as that of a full
+##  parse.
+##  Limits (maxtokens, maxnodes, maxtime) apply to the whole page:
+##  the tokens and trees of the pieces used are added up, and the
+##  time is counted from the start of parse(). A piece that goes
+##  over them (or fails) is parsed again here with what is left,
+##  so a limit is exceeded at the same place as in a full parse.
+##
+class WikiParallelParser:
+
+    SPLIT = re.compile(r'\n+(?==)|\n\n+(?=[^\n#])')
+
+    def __init__(self, workers=None, piecesize=256*1024,
+                 klass=WikiTextParser, **kwargs):
+        assert kwargs.get('checkpoint_interval') is None
+        self.workers = workers
+        self.piecesize = piecesize
+        self.klass = klass
+        self.kwargs = kwargs
+        self.pieces = 0
+        self.fallbacks = 0
+        self.exceeded = None
+        self._pool = None
+        self._broken = False
+        return
+
+    def __repr__(self):
+        return (f'<{self.__class__.__name__} pieces={self.pieces}'
+                f' fallbacks={self.fallbacks}>')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        return
+
+    def get_starts(self, text):
+        starts = [0]
+        while 1:
+            m = self.SPLIT.search(text, starts[-1]+self.piecesize)
+            if m is None or len(text) <= m.end(): break
+            starts.append(m.end())
+        return starts
+
+    def parse(self, text):
+        starts = self.get_starts(text)
+        ends = starts[1:] + [len(text)]
+        n = len(starts)
+        self.exceeded = None
+        deadline = None
+        if self.kwargs.get('maxtime') is not None:
+            deadline = time.time() + self.kwargs['maxtime']
+        results = None
+        if 1 < n:
+            results = self._map(text, starts, ends, deadline)
+        if results is None:
+            # The whole page is parsed here.
+            parser = self.klass(**self.kwargs)
+            parser.feed_text(text)
+            parser.close()
+            self.exceeded = parser.exceeded
+            return parser.get_root()
+        root = WikiPageTree()
+        (tokens, nodes) = (0, 0)
+        i = 0
+        while i < n:
+            (ended, data, error, ntokens, nnodes) = results[i]
+            if (error is None and (ended or i == n-1) and
+                self._within(tokens+ntokens, nodes+nnodes)):
+                tree = decode_tree(data)
+                (tokens, nodes) = (tokens+ntokens, nodes+nnodes)
+                self.pieces += 1
+                i += 1
+            else:
+                # Something is still open, or the piece is over the
+                # limits or failed: parse on from here.
+                kwargs = self._get_kwargs(tokens, nodes, deadline)
+                (i, _, parser) = _parse_pieces(
+                    self.klass, kwargs, text, starts, ends, i)
+                (tokens, nodes) = (tokens+parser._tokens, nodes+parser._nodes)
+                self.exceeded = parser.exceeded
+                tree = parser.get_root()
+                self.fallbacks += 1
+            _join(root, tree)
+        root.finish()
+        return root
+
+    def _within(self, tokens, nodes):
+        maxtokens = self.kwargs.get('maxtokens')
+        maxnodes = self.kwargs.get('maxnodes')
+        return ((maxtokens is None or tokens <= maxtokens) and
+                (maxnodes is None or nodes <= maxnodes))
+
+    def _get_kwargs(self, tokens, nodes, deadline):
+        # Parser arguments with the limits that are left.
+        kwargs = dict(self.kwargs)
+        if kwargs.get('maxtokens') is not None:
+            kwargs['maxtokens'] -= tokens
+        if kwargs.get('maxnodes') is not None:
+            kwargs['maxnodes'] -= nodes
+        if deadline is not None:
+            kwargs['maxtime'] = deadline - time.time()
+        return kwargs
+
+    def _map(self, text, starts, ends, deadline):
+        # Returns the results of the pieces, or None without a pool.
+        if self._broken: return None
+        # A piece over the limits is parsed again here.
+        kwargs = dict(self.kwargs, degrade=False)
+        try:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.workers)
+            futures = [
+                self._pool.submit(_parse_piece, self.klass, kwargs,
+                                  text[s:e], s, deadline)
+                for (s,e) in zip(starts, ends) ]
+            return [ future.result() for future in futures ]
+        except (OSError, NotImplementedError, BrokenProcessPool):
+            self._broken = True
+            self.close()
+            return None
+
+
+# Parses the pieces from i until nothing is open. Returns the next
+# piece, whether it can be parsed on its own and the parser.
+# After a limit is exceeded with degrade, all the pieces are fed.
+def _parse_pieces(klass, kwargs, text, starts, ends, i):
+    parser = klass(**kwargs)
+    parser._pos = starts[i]
+    while 1:
+        parser.feed_text(text[starts[i]:ends[i]])
+        i += 1
+        if i == len(starts) or parser._at_top(): break
+    ended = parser._at_top()
+    parser.close()
+    return (i, ended, parser)
+
+# Parses a piece in a worker process. Returns whether it ended
+# with nothing open, the encoded tree or an error, and the tokens
+# and trees counted for the limits. Errors are only raised by the
+# caller if the piece is used.
+def _parse_piece(klass, kwargs, text, start, deadline):
+    if deadline is not None:
+        kwargs = dict(kwargs, maxtime=deadline-time.time())
+    parser = klass(**kwargs)
+    parser._pos = start
+    try:
+        parser.feed_text(text)
+        ended = parser._at_top()
+        parser.close()
+    except WikiParserError as e:
+        return (False, None, e, 0, 0)
+    return (ended, encode_tree(parser.get_root()), None,
+            parser._tokens, parser._nodes)
+
+# Adds the children of tree to root. Text at the seam is joined
+# as in a full parse.
+def _join(root, tree):
+    children = list(tree)
+    if children:
+        root.append(children[0])
+        root.finish()
+        root._subtree.extend(children[1:])
+    return
+
+def _digest(text):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(text.encode('utf-8', 'surrogatepass'))
+    return h.digest()
+
+# Copies the trees and tokens in nodes with their positions moved.
+def _move_token(t, delta):
+    if isinstance(t, WikiVarToken):
+        return t.__class__(t.name, t.pos+delta)
+    elif isinstance(t, XMLTagToken):
+        return t.__class__(t.name, t.pos+delta,
+                           attr=t._attrs, rawattrs=t._rawattrs)
+    else:
+        return t
+
+def _move_tree(tree, delta):
+    copy = tree.__class__.__new__(tree.__class__)
+    copy.__dict__.update(tree.__dict__)
+    copy._subtree = []
+    if 'token' in copy.__dict__:
+        copy.token = _move_token(copy.token, delta)
+    if 'xml' in copy.__dict__:
+        copy.xml = _move_token(copy.xml, delta)
+    if tree._outer is tree:
+        copy._outer = copy
+    return copy
+
+def _move(nodes, delta):
+    moved = []
+    stack = []
+    (dst, it) = (moved, iter(nodes))
+    while 1:
+        for x in it:
+            if isinstance(x, WikiTree):
+                tree = _move_tree(x, delta)
+                dst.append(tree)
+                stack.append((dst, it))
+                (dst, it) = (tree._subtree, iter(x))
+                break
+            else:
+                dst.append(_move_token(x, delta))
+        else:
+            if not stack: break
+            (dst, it) = stack.pop()
+    return moved
+
+
+# main
+def main(argv):
+    import getopt
+    from utils import getfp
+    def usage():
+        print(f'usage: {argv[0]} [-j workers] [-s piecesize] [file ...]')
+        return 100
+    try:
+        (opts, args) = getopt.getopt(argv[1:], 'j:s:')
+    except getopt.GetoptError:
+        return usage()
+    workers = None
+    piecesize = 256*1024
+    for (k, v) in opts:
+        if k == '-j': workers = int(v)
+        elif k == '-s': piecesize = int(v)
+    if workers is None:
+        # Files are successive revisions of a page.
+        parser = WikiSectionParser()
+    else:
+        parser = WikiParallelParser(workers=workers, piecesize=piecesize)
+    for path in (args or ['-']):
+        (_,fp) = getfp(path)
+        parser.parse(fp.read())
+        fp.close()
+        print(path, parser)
+    if workers is not None:
+        parser.close()
+    return
+
+if __name__ == '__main__': sys.exit(main(sys.argv))
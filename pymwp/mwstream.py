@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+import sys
+from .mwparser import WikiTree
+from .mwparser import WikiTextParser
+
+
+##  WikiStreamParser
+##
+##  A WikiTextParser that does not build a tree.
+##  start_tree(tree) and end_tree(tree) are called when a tree is
+##  opened and closed, and handle_leaf(t) for each token or text
+##  in between. The trees passed are always empty, so the memory
+##  used is bounded by the nesting depth, not by the page size.
+##  Trees still open at close() are closed there.
+##  feed_tree() gives the same events for a tree already parsed
+##  (its trees are not empty, and text may come in larger pieces).
+##
+class WikiStreamParser(WikiTextParser):
+
+    def __init__(self, **kwargs):
+        # Events cannot be taken back, so no checkpoints.
+        assert kwargs.get('checkpoint_interval') is None
+        WikiTextParser.__init__(self, **kwargs)
+        return
+
+    def close(self):
+        WikiTextParser.close(self)
+        while 1 < len(self._stack):
+            self._pop_context()
+        return
+
+    def feed_tree(self, tree):
+        stack = []
+        it = iter(tree)
+        while 1:
+            for x in it:
+                if isinstance(x, WikiTree):
+                    self.start_tree(x)
+                    stack.append((x, it))
+                    it = iter(x)
+                    break
+                else:
+                    self.handle_leaf(x)
+            else:
+                if not stack: break
+                (x, it) = stack.pop()
+                self.end_tree(x)
+        return
+
+    def start_tree(self, tree):
+        return
+
+    def end_tree(self, tree):
+        return
+
+    def handle_leaf(self, t):
+        return
+
+    def _append(self, t):
+        self.handle_leaf(t)
+        return
+
+    def _append_tree(self, t):
+        self.start_tree(t)
+        return
+
+    def _pop_context(self):
+        tree = self._tree
+        WikiTextParser._pop_context(self)
+        self.end_tree(tree)
+        return
+
+
+# main
+def main(argv):
+    from utils import getfp
+    class Printer(WikiStreamParser):
+        def start_tree(self, tree):
+            print(' '*len(self._stack)+'('+repr(tree))
+            return
+        def end_tree(self, tree):
+            print(' '*len(self._stack)+')')
+            return
+        def handle_leaf(self, t):
+            print(' '*len(self._stack)+repr(t))
+            return
+    args = argv[1:] or ['-']
+    for path in args:
+        print(path, file=sys.stderr)
+        (_,fp) = getfp(path)
+        parser = Printer()
+        parser.feed_file(fp, blocksize=65536)
+        parser.close()
+        fp.close()
+    return
+
+if __name__ == '__main__': sys.exit(main(sys.argv))
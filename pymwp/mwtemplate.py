@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+import sys
+from .mwtokenizer import WikiToken
+from .mwtokenizer import XMLTagToken
+from .mwparser import WikiTextParser
+from .mwparser import WikiArgTree
+from .mwparser import WikiSpecialTree
+from .mwstream import WikiStreamParser
+
+
+##  WikiTemplate
+##
+##  A template call {{name|arg|...|key=value|...}}.
+##  args are the positional arguments and named the named ones,
+##  as stripped wikitext. start and end are its position in the page.
+##
+class WikiTemplate:
+
+    def __init__(self, name, args, named, start, end):
+        self.name = name
+        self.args = args
+        self.named = named
+        self.start = start
+        self.end = end
+        return
+
+    def __repr__(self):
+        return (f'<{self.__class__.__name__} {self.name!r}'
+                f' args={self.args!r} named={self.named!r}>')
+
+    def get_arg(self, key, value=None):
+        # key is 1, 2, ... for positional arguments.
+        if isinstance(key, int):
+            key = str(key)
+        if key in self.named:
+            return self.named[key]
+        if key.isdigit() and 0 < int(key) <= len(self.args):
+            return self.args[int(key)-1]
+        return value
+
+    def get_items(self):
+        # Returns (key, value) of all arguments; a named argument
+        # overrides a positional one with the same number.
+        items = { str(i+1): v for (i,v) in enumerate(self.args) }
+        items.update(self.named)
+        return items.items()
+
+
+def get_template_name(name):
+    # Returns the normalized template name, or None for parser
+    # functions ({{#if:...}}), magic words ({{DEFAULTSORT:...}})
+    # and template parameters ({{{1}}}).
+    name = ' '.join(name.replace('_', ' ').split())
+    while 1:
+        (prefix, sep, rest) = name.partition(':')
+        if not sep: break
+        if prefix.lower() in ('template', 'subst', 'safesubst'):
+            name = rest.strip()
+        elif prefix.isupper() or prefix.startswith('#'):
+            return None
+        else:
+            break
+    if not name or name[0] in '#{':
+        return None
+    return name[0].upper()+name[1:]
+
+def get_field_name(key):
+    # Returns the normalized key of a named argument
+    # ('Birth_Date ' -> 'birth date').
+    return ' '.join(key.replace('_', ' ').split()).lower()
+
+
+##  WikiTemplateParser
+##
+##  A WikiStreamParser that collects the templates of a page
+##  (including those inside templates) into templates, ordered by
+##  position. Arguments are taken from the source text, so the
+##  input is kept from the start of the outermost open template.
+##
+class WikiTemplateParser(WikiStreamParser):
+
+    def __init__(self, **kwargs):
+        WikiStreamParser.__init__(self, **kwargs)
+        self.templates = []
+        # Position and token being parsed.
+        self._cur = 0
+        self._curtoken = None
+        # Open templates.
+        self._calls = []
+        # Inputs as [(pos, text), ...].
+        self._inputs = []
+        return
+
+    def feed_text(self, text):
+        self._inputs.append((self._pos, text))
+        WikiStreamParser.feed_text(self, text)
+        # A template can start in the last input.
+        if self._calls:
+            start = self._calls[0].start
+        else:
+            start = self._inputs[-1][0]
+        while 1 < len(self._inputs) and self._inputs[1][0] <= start:
+            self._inputs.pop(0)
+        return
+
+    def close(self):
+        WikiTextParser.close(self)
+        # Trees still open end here.
+        (self._cur, self._curtoken) = (self._pos, None)
+        while 1 < len(self._stack):
+            self._pop_context()
+        self.templates.sort(key=lambda t: t.start)
+        return
+
+    def handle_token(self, pos, token):
+        (self._cur, self._curtoken) = (pos, token)
+        WikiStreamParser.handle_token(self, pos, token)
+        return
+
+    def handle_text(self, pos, text):
+        (self._cur, self._curtoken) = (pos, None)
+        WikiStreamParser.handle_text(self, pos, text)
+        return
+
+    def start_tree(self, tree):
+        if isinstance(tree, WikiSpecialTree):
+            self._calls.append(_WikiCall(tree, self._cur))
+        elif self._calls:
+            call = self._calls[-1]
+            if self._tree is call.tree:
+                # A new argument.
+                assert isinstance(tree, WikiArgTree), tree
+                call.start_arg(tree, self._cur)
+            elif self._tree is call.argtree:
+                call.set_limit(self._cur)
+        return
+
+    def end_tree(self, tree):
+        if not self._calls: return
+        call = self._calls[-1]
+        if tree is call.argtree:
+            call.end_arg(self._cur, self._curtoken is WikiToken.BAR)
+        elif tree is call.tree:
+            self._calls.pop()
+            # Templates not closed by }} are not used.
+            if self._curtoken is not WikiToken.SPECIAL_CLOSE: return
+            end = self._cur+len(WikiToken.SPECIAL_CLOSE.name)
+            template = call.get_template(self._get_source, end)
+            if template is not None:
+                self.templates.append(template)
+        return
+
+    def handle_leaf(self, t):
+        if not self._calls: return
+        call = self._calls[-1]
+        if self._tree is not call.argtree:
+            pass
+        elif t is WikiToken.TABLE_DATA or t is WikiToken.TABLE_DATA_SEP:
+            # '|' at the beginning of a line and '||' are not
+            # told apart from BAR by the tokenizer.
+            call.split_arg(self._cur, len(t.name))
+        elif isinstance(t, XMLTagToken):
+            call.set_limit(self._cur)
+        return
+
+    def _get_source(self, start, end):
+        parts = []
+        for (pos, text) in self._inputs:
+            if end <= pos: break
+            if start < pos+len(text):
+                parts.append(text[max(0, start-pos):end-pos])
+        return ''.join(parts)
+
+
+##  _WikiCall
+##
+##  An open template: the span of each argument and where its
+##  first tree or tag is (the key of a named argument is before it).
+##
+class _WikiCall:
+
+    def __init__(self, tree, start):
+        self.tree = tree
+        self.start = start
+        self.args = []
+        self.argtree = None
+        self._bar = False
+        return
+
+    def start_arg(self, tree, pos):
+        self.argtree = tree
+        self.args.append([pos, None, None])
+        self._bar = False
+        return
+
+    def end_arg(self, pos, bar):
+        self.args[-1][1] = pos
+        self.argtree = None
+        # An empty argument follows a trailing bar.
+        self._bar = bar
+        return
+
+    def split_arg(self, pos, n):
+        for i in range(n):
+            self.args[-1][1] = pos+i
+            self.args.append([pos+i+1, None, None])
+        return
+
+    def set_limit(self, pos):
+        if self.args[-1][2] is None:
+            self.args[-1][2] = pos
+        return
+
+    def get_template(self, get_source, end):
+        if self._bar:
+            self.args.append([end, end, None])
+        if not self.args: return None
+        (start, e, limit) = self.args[0]
+        name = get_template_name(get_source(start, limit or e))
+        if name is None: return None
+        args = []
+        named = {}
+        for (start, e, limit) in self.args[1:]:
+            text = get_source(start, e)
+            i = text.find('=', 0, (limit or e)-start)
+            if 0 <= i:
+                named[text[:i].strip()] = text[i+1:].strip()
+            else:
+                args.append(text.strip())
+        return WikiTemplate(name, args, named, self.start, end)
+
+
+# main
+def main(argv):
+    from utils import getfp
+    args = argv[1:] or ['-']
+    for path in args:
+        print(path, file=sys.stderr)
+        (_,fp) = getfp(path)
+        parser = WikiTemplateParser()
+        parser.feed_file(fp, blocksize=65536)
+        parser.close()
+        fp.close()
+        for t in parser.templates:
+            print(t.start, t.end, t)
+    return
+
+if __name__ == '__main__': sys.exit(main(sys.argv))
@@ -1,12 +1,70 @@
 #!/usr/bin/env python
 import sys
-from html.entities import name2codepoint
+import re
+import io
+import codecs
+from array import array
+from html.entities import name2codepoint, html5
+
+
+def lower(s):
+    # str.lower() is context sensitive for some letters (final sigma),
+    # so non-ASCII names are lowered one character at a time.
+    if s.isascii():
+        return s.lower()
+    return ''.join( c.lower() for c in s )
+
+
+##  Entities
+##
+##  ENTITIES maps '&name' to its decoded text for all HTML5 named
+##  entities. The HTML4 names keep their old code points.
+##
+ENTITIES = { '&'+k[:-1]: v for (k,v) in html5.items() if k.endswith(';') }
+ENTITIES.update( ('&'+k, chr(v)) for (k,v) in name2codepoint.items() )
+ENTITY_CACHE_SIZE = 10000
+_entity_cache = {}
+
+def decode_entity(s):
+    # s is '&name', '&#123' or '&#x1f' (without ';').
+    # Returns None if a numeric reference is invalid.
+    try:
+        return ENTITIES[s]
+    except KeyError:
+        pass
+    try:
+        return _entity_cache[s]
+    except KeyError:
+        pass
+    if not s.startswith('&#'):
+        v = s
+    else:
+        try:
+            if s[2:3] in ('x','X'):
+                v = chr(int(s[3:], 16))
+            else:
+                v = chr(int(s[2:]))
+        except (ValueError, OverflowError):
+            v = None
+    if ENTITY_CACHE_SIZE <= len(_entity_cache):
+        _entity_cache.clear()
+    _entity_cache[s] = v
+    return v
 
 
 ##  Token
 ##
+##  Tokens use __slots__ so that whole pages of them can be kept
+##  in memory. On CPython 3.11 (64-bit) a WikiToken takes 40 bytes,
+##  a WikiHeadlineToken/WikiItemizeToken 48 bytes and an XML tag
+##  token 64 bytes, plus its attribute dict or raw attribute text.
+##  (Previously each token also carried a __dict__ of ~300 bytes.)
+##  Tag names and attribute keys are interned.
+##
 class Token:
 
+    __slots__ = ('name',)
+
     def __init__(self, name):
         self.name = name
         return
@@ -21,18 +79,35 @@ class Token:
 
 ##  WikiToken
 ##
-class WikiToken(Token): pass
-class ExtensionToken(Token): pass
-class WikiBOLToken(WikiToken): pass
+class WikiToken(Token):
+
+    __slots__ = ()
+
+    def __reduce_ex__(self, protocol):
+        # The shared tokens (WikiToken.EOL, ...) are unpickled and
+        # copied as themselves, so that they can be compared with is.
+        key = _SHARED.get(id(self))
+        if key is not None:
+            return (getattr, (WikiToken, key))
+        return Token.__reduce_ex__(self, protocol)
+
+class ExtensionToken(Token):
+    __slots__ = ()
+class WikiBOLToken(WikiToken):
+    __slots__ = ()
 class WikiVarToken(WikiToken):
 
+    __slots__ = ('pos',)
+
     def __init__(self, name='', pos=0):
         Token.__init__(self, name)
         self.pos = pos
         return
 
-class WikiHeadlineToken(WikiVarToken): pass
-class WikiItemizeToken(WikiVarToken): pass
+class WikiHeadlineToken(WikiVarToken):
+    __slots__ = ()
+class WikiItemizeToken(WikiVarToken):
+    __slots__ = ()
 
 WikiToken.EOL = WikiToken('\n')
 WikiToken.BLANK = WikiToken(' ')
@@ -59,12 +134,16 @@ WikiToken.TABLE_DATA_SEP = WikiToken('||')
 WikiToken.HR = WikiToken('HR')
 WikiToken.PAR = WikiToken('PAR')
 WikiToken.PRE = WikiToken('PRE')
+_SHARED = { id(v): k for (k,v) in vars(WikiToken).items()
+            if isinstance(v, WikiToken) }
 
 
 ##  XMLTagToken
 ##
 class XMLTagToken(Token):
 
+    __slots__ = ('pos', '_attrs', '_rawattrs')
+
     def TAGS(x): return frozenset(x.split(' '))
 
     # Used by tokenizer.
@@ -93,115 +172,323 @@ class XMLTagToken(Token):
     NO_TEXT = TAGS('ref gallery')
     BR_TAG = TAGS('br')
 
-    def __init__(self, name='', pos=0, attr=None):
+    def __init__(self, name='', pos=0, attr=None, rawattrs=None):
         Token.__init__(self, name)
         self.pos = pos
-        self.attrs = attr or {}
+        # No dict is made for a tag without attributes.
+        self._attrs = attr or None
+        self._rawattrs = rawattrs
         return
 
     def __repr__(self):
         return f'<{self.__class__.__name__} {self.name!r}>'
 
+    @property
+    def attrs(self):
+        # Attributes are parsed from the raw text when first used.
+        if self._rawattrs is not None:
+            self._attrs = parse_xml_attrs(self._rawattrs)
+            self._rawattrs = None
+        if self._attrs is None:
+            self._attrs = {}
+        return self._attrs
+
+    @attrs.setter
+    def attrs(self, attrs):
+        self._attrs = attrs
+        self._rawattrs = None
+        return
+
     def get_attr(self, name, value=None):
+        if self._attrs is None and self._rawattrs is None:
+            return value
         return self.attrs.get(name, value)
 
 class XMLStartTagToken(XMLTagToken):
 
-    def __init__(self, name='', pos=0):
-        XMLTagToken.__init__(self, name=name, pos=pos)
-        self._key = self._value = None
-        return
+    __slots__ = ()
 
     def __repr__(self):
         attrs = ''.join( f' {k}={v}' for (k,v) in self.attrs.items() )
         return f'<{self.__class__.__name__} {self.name!r} {attrs}>'
 
-    def add_char(self, c):
-        if self._value is not None:
-            self._value += c
-        elif self._key is not None:
-            self._key += c
-        else:
-            XMLTagToken.add_char(self, c)
+    def set_attr(self, key, value):
+        if self._attrs is None:
+            self._attrs = {}
+        self._attrs[sys.intern(key)] = value
         return
 
-    def start_attr_key(self):
-        assert self._key is None, self._key
-        self._key = ''
-        return
+class XMLEndTagToken(XMLTagToken):
+    __slots__ = ()
+class XMLEmptyTagToken(XMLTagToken):
+    __slots__ = ()
 
-    def start_attr_value(self):
-        assert self._key is not None
-        assert self._value is None
-        self._value = ''
-        return
 
-    def end_attr(self):
-        assert self._key is not None
-        if self._value is None:
-            self.attrs[self._key.lower()] = self._key
-        else:
-            self.attrs[self._key.lower()] = self._value
-        self._key = self._value = None
+##  WikiCheckpoint
+##
+##  The state of a tokenizer/parser at the beginning of a line.
+##
+class WikiCheckpoint:
+
+    def __init__(self, pos, state):
+        self.pos = pos
+        self.state = state
         return
 
-class XMLEndTagToken(XMLTagToken): pass
-class XMLEmptyTagToken(XMLTagToken): pass
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.pos}>'
 
 
 ##  WikiTextTokenizer
 ##
 class WikiTextTokenizer:
 
-    class XMLEntityContext1:
-
-        def __init__(self, pos, handler, state):
-            self.pos = pos
-            self.handler = handler
-            self.state = state
-            self.name = ''
-            return
-
-        def handle_char(self, c):
-            self.handler(c)
-            return
-
-    class XMLEntityContext2(XMLEntityContext1):
-
-        def handle_char(self, c):
-            self.handler(self.pos, c)
-            return
-
-    def __init__(self):
+    # Characters that can start a token in _scan_main.
+    SPECIAL_CHAR = re.compile(r"[\s&<|!=\[\]{}']")
+    SPECIAL_CHAR_NOWIKI = re.compile(r'[&<]')
+    COMMENT_CHAR = re.compile(r'[^->]+')
+    # Runs of characters that are added to a token at once.
+    EXTENSION_CHAR = re.compile(r'\S+')
+    HEADLINE_CHAR = re.compile(r'=+')
+    ITEMIZE_CHAR = re.compile(r'[*#:;]+')
+    NAME_CHAR = re.compile(r'[^\W_]+')
+    ENDTAG_CHAR = re.compile(r'[^\s>]+')
+    ATTR_KEY_CHAR = re.compile(r'[^\s/>=]+')
+    ATTR_VALUE_CHAR = re.compile(r'[^\s/>"\'&]+')
+    ATTR_QUOTE_CHAR = {
+        '"': re.compile(r'[^"&]+'),
+        "'": re.compile(r"[^'&]+"),
+    }
+    # All the attributes of a start tag, up to the closing '/' or '>'.
+    ATTRS_CHAR = re.compile(
+        r'(?:\s+|'
+        r'[^\s/>=]*=[^\s/>"\']*(?:"[^"]*"|\'[^\']*\'|(?=[\s/>]|\Z))|'
+        r'[^\s/>=]+)*')
+    # What can be the beginning of an end tag.
+    ENDTAG_PREFIX = re.compile(r'<(?:/\s*[^\s>]*\s*)?')
+    # A whole entity. Group 1 is the digits of a decimal reference.
+    ENTITY_CHAR = re.compile(r'&(?:#(?:[xX][^\W_]*|(\d*))|[^\W_]*)')
+
+    # States that can be run from a transition table.
+    DFA_STATES = (
+        '_scan_main',
+        '_scan_bol2',
+        '_scan_bol_nl',
+        '_scan_bol_sp',
+        '_scan_bol_hr',
+        '_scan_bol_bar',
+        '_scan_bol_brace',
+        '_scan_headline_end',
+        '_scan_blank',
+        '_scan_comment',
+        '_scan_comment_h1',
+        '_scan_comment_h2',
+        '_scan_comment_h3',
+        '_scan_bracket_open',
+        '_scan_bracket_close',
+        '_scan_brace_open',
+        '_scan_brace_close',
+        '_scan_q1',
+        '_scan_q2',
+        '_scan_q3',
+        '_scan_q4',
+        '_scan_bar',
+        '_scan_exc',
+    )
+    # Characters that these states tell apart. Any other character
+    # is treated like ' ' if it is a space, or like 'a' otherwise.
+    DFA_CHARS = "\n&<|!=[]{}'-+> a"
+
+    # Keep the attributes of start tags unparsed until they are used.
+    LAZY_ATTRS = True
+
+    def __init__(self, dfa=False, checkpoint_interval=None,
+                 skip_tags=(), opaque_tags=()):
+        self.dfa = dfa
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoints = []
+        self._next_checkpoint = checkpoint_interval
+        # The content of these elements is not tokenized:
+        # skip_tags are dropped, opaque_tags are passed as one text.
+        # An element that is not closed goes on to the end.
+        self._skiptags = {}
+        for (tags, keep) in ((skip_tags, False), (opaque_tags, True)):
+            for name in tags:
+                endtag = re.compile(r'</\s*'+re.escape(name)+r'\s*>', re.I)
+                self._skiptags[name] = (name, keep, endtag)
+        self._skip = None
+        self._skiptail = ''
         self._scan = self._scan_bod
         self._wiki = True
         self._token = None
         self._entity = None
+        self._entity_pos = None
+        self._entity_scan = None
         self._line_token = None
         self._quote_close = None
+        self._attrkey = self._attrvalue = None
         self._pos = 0
-        self._textpos = self._text = None
+        self._buf = ''
+        self._textpos = None
+        self._textparts = []
+        self._textstart = self._textend = None
         return
 
     def close(self):
-        if self._text is not None:
-            self.handle_text(self._textpos, self._text)
-            self._textpos = self._text = None
+        if self._skip is not None and self._skiptail:
+            (_, keep, _) = self._skip
+            if keep:
+                self._handle_char(-len(self._skiptail), self._skiptail)
+            self._skiptail = ''
+        self._flush_text()
         return
 
-    def feed_file(self, fp):
+    def feed_file(self, fp, blocksize=None):
         self._lineno = 0
-        for line in fp:
-            self.feed_text(line)
-            self._lineno += 1
+        if blocksize is None:
+            for line in fp:
+                self.feed_text(line)
+                self._lineno += 1
+        else:
+            text = ''
+            for text in self._read_blocks(fp, blocksize):
+                self.feed_text(text)
+                self._lineno += text.count('\n')
+            if text and not text.endswith('\n'):
+                self._lineno += 1
+        return
+
+    def _read_blocks(self, fp, blocksize):
+        buf = getattr(fp, 'buffer', None)
+        if buf is None:
+            while 1:
+                text = fp.read(blocksize)
+                if not text: break
+                yield text
+        else:
+            # Decode the bytes ourselves so that a character split
+            # between two blocks is kept whole.
+            decoder = codecs.getincrementaldecoder(fp.encoding)(fp.errors)
+            decoder = io.IncrementalNewlineDecoder(decoder, True)
+            while 1:
+                data = buf.read(blocksize)
+                text = decoder.decode(data, final=(not data))
+                if text:
+                    yield text
+                if not data: break
         return
 
     def feed_text(self, text):
+        self._buf = text
+        if self.dfa:
+            self._feed_dfa(text)
+        else:
+            i = 0
+            while 0 <= i and i < len(text):
+                i = self._scan(i, text[i])
+                assert i is not None
+        if self._textstart is not None:
+            self._textparts.append(text[self._textstart:self._textend])
+            self._textstart = self._textend = None
+        self._pos += len(text)
+        return
+
+    def get_checkpoint(self, pos):
+        # Returns the last checkpoint before pos. The state of a
+        # checkpoint may depend on the character at its position
+        # (e.g. a blank line goes on), so one at pos is not used.
+        for checkpoint in reversed(self.checkpoints):
+            if checkpoint.pos < pos:
+                return checkpoint
+        return None
+
+    def restore_checkpoint(self, checkpoint):
+        # Rewinds to the checkpoint. The text from checkpoint.pos
+        # should be fed again after this.
+        i = self.checkpoints.index(checkpoint)
+        del self.checkpoints[i+1:]
+        self._restore_state(checkpoint.state)
+        self._pos = checkpoint.pos
+        self._buf = ''
+        if self.checkpoint_interval is not None:
+            self._next_checkpoint = checkpoint.pos + self.checkpoint_interval
+        return
+
+    def _add_checkpoint(self, i):
+        assert self._textpos is None and self._textstart is None
+        pos = self._pos+i
+        self.checkpoints.append(WikiCheckpoint(pos, self._save_state()))
+        self._next_checkpoint = pos + self.checkpoint_interval
+        return
+
+    def _at_bol(self):
+        # True at the beginning of a line with nothing pending,
+        # i.e. a new tokenizer would go on the same way from here.
+        return (self._scan.__name__ in ('_scan_bol', '_scan_bol_nl') and
+                self._wiki and self._skip is None and self._textpos is None)
+
+    def _save_state(self):
+        return (self._scan.__name__, self._wiki)
+
+    def _restore_state(self, state):
+        (name, self._wiki) = state
+        self._scan = getattr(self, name)
+        self._token = None
+        self._entity = self._entity_pos = self._entity_scan = None
+        self._line_token = None
+        self._quote_close = None
+        self._attrkey = self._attrvalue = None
+        self._skip = None
+        self._skiptail = ''
+        self._textpos = None
+        self._textparts = []
+        self._textstart = self._textend = None
+        return
+
+    def tokenize(self, text):
+        # Tokenizes a whole document into a WikiTokenArray
+        # without calling handle_token()/handle_text().
+        assert self._pos == 0
+        tokens = WikiTokenArray(text)
+        self.handle_token = tokens.add_token
+        self.handle_text = tokens.add_text
+        try:
+            self._buf = text
+            i = 0
+            while 0 <= i and i < len(text):
+                i = self._scan(i, text[i])
+                if tokens.pending is not None:
+                    tokens.set_end(i)
+            self._pos += len(text)
+            WikiTextTokenizer.close(self)
+            if tokens.pending is not None:
+                tokens.set_end(len(text))
+        finally:
+            del self.handle_token
+            del self.handle_text
+        return tokens
+
+    def _feed_dfa(self, text):
+        # Same as the loop in feed_text() but most states are run
+        # from a table that maps (state, character) to an action.
+        dfa = get_dfa()
         i = 0
         while 0 <= i and i < len(text):
-            i = self._scan(i, text[i])
-            assert i is not None
-        self._pos += len(text)
+            c = text[i]
+            row = dfa[self._wiki].get(self._scan.__func__)
+            if row is not None:
+                action = row.get(c)
+                if action is None:
+                    action = row[' ' if c.isspace() else 'a']
+                    row[c] = action
+                if action:
+                    (calls, state, step) = action
+                    for (name, offset, arg) in calls:
+                        getattr(self, name)(i+offset, arg)
+                    self._scan = getattr(self, state)
+                    i += step
+                    continue
+            i = self._scan(i, c)
         return
 
     def handle_token(self, pos, token):
@@ -211,24 +498,67 @@ class WikiTextTokenizer:
 
     def _handle_token(self, i, token):
         pos = self._pos + i
-        if self._text is not None:
-            self.handle_text(self._textpos, self._text)
-            self._textpos = self._text = None
-        if (isinstance(token, XMLStartTagToken) and
-            token.name in XMLTagToken.NO_WIKI):
-            self._wiki = False
-        elif (isinstance(token, XMLEndTagToken) and
-              token.name in XMLTagToken.NO_WIKI):
-            self._wiki = True
+        self._flush_text()
+        if isinstance(token, XMLTagToken):
+            token.name = sys.intern(token.name)
+            if token.name in XMLTagToken.NO_WIKI:
+                if isinstance(token, XMLStartTagToken):
+                    self._wiki = False
+                elif isinstance(token, XMLEndTagToken):
+                    self._wiki = True
         self.handle_token(pos, token)
         return
 
+    def _flush_text(self):
+        if self._textpos is None: return
+        if self._textstart is not None:
+            text = self._buf[self._textstart:self._textend]
+            if self._textparts:
+                self._textparts.append(text)
+                text = ''.join(self._textparts)
+        else:
+            text = ''.join(self._textparts)
+        pos = self._textpos
+        self._textpos = None
+        self._textparts = []
+        self._textstart = self._textend = None
+        self.handle_text(pos, text)
+        return
+
+    def _handle_span(self, i, j):
+        # Text is kept as offsets into the current input
+        # as long as it is contiguous.
+        if self._textend == i:
+            self._textend = j
+            return
+        if self._textpos is None:
+            self._textpos = self._pos+i
+        elif self._textstart is not None:
+            self._textparts.append(self._buf[self._textstart:self._textend])
+        self._textstart = i
+        self._textend = j
+        return
+
     def _handle_char(self, i, c):
-        if self._text is None:
+        if self._textpos is None:
             self._textpos = self._pos+i
-            self._text = c
+        elif self._textstart is not None:
+            self._textparts.append(self._buf[self._textstart:self._textend])
+            self._textstart = self._textend = None
+        self._textparts.append(c)
+        return
+
+    def _handle_run(self, i, n):
+        self._handle_span(i, i+n)
+        return
+
+    def _handle_prev(self, i, c):
+        # c is the character right before i, which might be
+        # at the end of the previous input.
+        if 0 < i:
+            self._handle_span(i-1, i)
         else:
-            self._text += c
+            self._handle_char(i-1, c)
         return
 
     def _scan_bod(self, i, c):
@@ -247,11 +577,15 @@ class WikiTextTokenizer:
             self._scan = self._scan_main
             return i+1
         else:
-            self._token.add_char(c)
-            return i+1
+            j = self.EXTENSION_CHAR.match(self._buf, i).end()
+            self._token.add_char(self._buf[i:j])
+            return j
 
     def _scan_bol(self, i, c):
         self._line_token = None
+        if (self._next_checkpoint is not None and
+            self._next_checkpoint <= self._pos+i):
+            self._add_checkpoint(i)
         if c == '\n':
             self._handle_token(i, WikiToken.PAR)
             self._scan = self._scan_bol_nl
@@ -268,12 +602,12 @@ class WikiTextTokenizer:
             self._scan = self._scan_main
             return i+1
         elif c == '=':
-            self._token = WikiHeadlineToken(name=c, pos=i)
+            self._token = WikiHeadlineToken(name=c, pos=self._pos+i)
             self._line_token = self._token
             self._scan = self._scan_bol_headline
             return i+1
         elif c in '*#:;':
-            self._token = WikiItemizeToken(name=c, pos=i)
+            self._token = WikiItemizeToken(name=c, pos=self._pos+i)
             self._scan = self._scan_bol_itemize
             return i+1
         elif c.isspace():
@@ -337,10 +671,11 @@ class WikiTextTokenizer:
     def _scan_bol_headline(self, i, c):
         assert isinstance(self._token, WikiHeadlineToken), self._token
         if c == '=':
-            self._token.add_char(c)
-            return i+1
+            j = self.HEADLINE_CHAR.match(self._buf, i).end()
+            self._token.add_char(self._buf[i:j])
+            return j
         else:
-            self._handle_token(self._token.pos, self._token)
+            self._handle_token(self._token.pos-self._pos, self._token)
             self._token = None
             self._scan = self._scan_main
             return i
@@ -348,10 +683,11 @@ class WikiTextTokenizer:
     def _scan_bol_itemize(self, i, c):
         assert isinstance(self._token, WikiItemizeToken), self._token
         if c in '*#:;':
-            self._token.add_char(c)
-            return i+1
+            j = self.ITEMIZE_CHAR.match(self._buf, i).end()
+            self._token.add_char(self._buf[i:j])
+            return j
         else:
-            self._handle_token(self._token.pos, self._token)
+            self._handle_token(self._token.pos-self._pos, self._token)
             self._token = None
             self._scan = self._scan_bol2
             return i
@@ -368,18 +704,12 @@ class WikiTextTokenizer:
     def _scan_main(self, i, c):
         assert self._token is None, self._token
         if c == '&':
-            self._entity = self.XMLEntityContext2(
-                i,
-                self._handle_char,
-                self._scan_main)
-            self._scan = self._scan_entity
-            return i+1
+            return self._start_entity(i, self._scan_main)
         elif c == '<':
             self._scan = self._scan_tag
             return i+1
         elif not self._wiki:
-            self._handle_char(i, c)
-            return i+1
+            return self._scan_text(i, self.SPECIAL_CHAR_NOWIKI)
         elif c == '\n':
             self._handle_token(i, WikiToken.EOL)
             self._scan = self._scan_bol
@@ -415,8 +745,14 @@ class WikiTextTokenizer:
             self._scan = self._scan_q1
             return i+1
         else:
-            self._handle_char(i, c)
-            return i+1
+            return self._scan_text(i, self.SPECIAL_CHAR)
+
+    def _scan_text(self, i, special):
+        # Pass a whole run of plain text at once.
+        m = special.search(self._buf, i+1)
+        j = m.start() if m else len(self._buf)
+        self._handle_span(i, j)
+        return j
 
     def _scan_headline_end(self, i, c):
         if c == '=':
@@ -436,9 +772,40 @@ class WikiTextTokenizer:
             self._scan = self._scan_main
             return i
 
+    def _start_entity(self, i, state):
+        self._entity_pos = self._pos+i
+        self._entity_scan = state
+        m = self.ENTITY_CHAR.match(self._buf, i)
+        j = m.end()
+        if (j < len(self._buf) and
+            (m.group(1) is None or not self._buf[j].isdigit())):
+            # The whole entity is in the buffer.
+            self._entity = m.group(0)
+            return self._end_entity(j, self._buf[j])
+        self._entity = '&'
+        self._scan = self._scan_entity
+        return i+1
+
+    def _end_entity(self, i, c):
+        s = decode_entity(self._entity)
+        if s is None:
+            pass
+        elif self._attrvalue is None:
+            # Not inside an attribute value.
+            self._handle_char(self._entity_pos-self._pos, s)
+        else:
+            self._add_value_char(s)
+        self._scan = self._entity_scan
+        self._entity = self._entity_scan = None
+        if c == ';':
+            return i+1
+        else:
+            return i
+
     def _scan_entity(self, i, c):
         assert self._entity is not None
         if c == '#':
+            self._entity += c
             self._scan = self._scan_ent_numhex
             return i+1
         else:
@@ -448,6 +815,7 @@ class WikiTextTokenizer:
     def _scan_ent_numhex(self, i, c):
         assert self._entity is not None
         if c in 'xX':
+            self._entity += c
             self._scan = self._scan_ent_hex
             return i+1
         else:
@@ -457,56 +825,26 @@ class WikiTextTokenizer:
     def _scan_ent_hex(self, i, c):
         assert self._entity is not None
         if c.isalnum():
-            self._entity.name += c
-            return i+1
-        else:
-            try:
-                n = int(self._entity.name, 16)
-                self._entity.handle_char(chr(n))
-            except ValueError:
-                pass
-            self._scan = self._entity.state
-            self._entity = None
-            if c == ';':
-                return i+1
-            else:
-                return i
+            self._entity += c
+            return i+1
+        else:
+            return self._end_entity(i, c)
 
     def _scan_ent_num(self, i, c):
         assert self._entity is not None
         if c.isdigit():
-            self._entity.name += c
-            return i+1
-        else:
-            try:
-                n = int(self._entity.name)
-                self._entity.handle_char(chr(n))
-            except ValueError:
-                pass
-            self._scan = self._entity.state
-            self._entity = None
-            if c == ';':
-                return i+1
-            else:
-                return i
+            self._entity += c
+            return i+1
+        else:
+            return self._end_entity(i, c)
 
     def _scan_ent_name(self, i, c):
         assert self._entity is not None
         if c.isalnum():
-            self._entity.name += c
-            return i+1
-        else:
-            try:
-                n = name2codepoint[self._entity.name]
-                self._entity.handle_char(chr(n))
-            except KeyError:
-                self._entity.handle_char('&'+self._entity.name)
-            self._scan = self._entity.state
-            self._entity = None
-            if c == ';':
-                return i+1
-            else:
-                return i
+            self._entity += c
+            return i+1
+        else:
+            return self._end_entity(i, c)
 
     def _scan_tag(self, i, c):
         if c == '!':
@@ -514,20 +852,26 @@ class WikiTextTokenizer:
             self._scan = self._scan_comment
             return i+1
         elif c == '/':
-            self._token = XMLEndTagToken(pos=i-1)
+            self._token = XMLEndTagToken(pos=self._pos+i-1)
             self._scan = self._scan_endtag
             return i+1
         else:
-            self._token = XMLStartTagToken(pos=i-1)
+            self._token = XMLStartTagToken(pos=self._pos+i-1)
             self._scan = self._scan_starttag_name
             return i
 
     def _scan_starttag_name(self, i, c):
         assert isinstance(self._token, XMLStartTagToken), self._token
         if c.isalnum():
-            self._token.add_char(c.lower())
-            return i+1
+            j = self.NAME_CHAR.match(self._buf, i).end()
+            self._token.add_char(lower(self._buf[i:j]))
+            return j
         else:
+            if self.LAZY_ATTRS:
+                j = self.ATTRS_CHAR.match(self._buf, i).end()
+                if i < j and j < len(self._buf) and self._buf[j] in '/>':
+                    self._token._rawattrs = self._buf[i:j]
+                    i = j
             self._scan = self._scan_starttag_mid
             return i
 
@@ -537,27 +881,67 @@ class WikiTextTokenizer:
             # Treat as an empty tag if it's one.
             if self._token.name not in XMLTagToken.VALID_TAG:
                 self._token = XMLEmptyTagToken(
-                    self._token.name, self._token.pos, self._token.attrs)
-            self._handle_token(self._token.pos, self._token)
-            self._token = None
+                    self._token.name, self._token.pos,
+                    self._token._attrs, self._token._rawattrs)
+            self._handle_token(self._token.pos-self._pos, self._token)
             self._scan = self._scan_main
+            # Tags inside nowiki/source are not elements.
+            if (self._skiptags and
+                isinstance(self._token, XMLStartTagToken) and
+                self._token.name in self._skiptags and
+                (self._wiki or self._token.name in XMLTagToken.NO_WIKI)):
+                self._skip = self._skiptags[self._token.name]
+                self._scan = self._scan_skip
+            self._token = None
             return i+1
         elif c == '/':
             self._token = XMLEmptyTagToken(
-                self._token.name, self._token.pos, self._token.attrs)
+                self._token.name, self._token.pos,
+                self._token._attrs, self._token._rawattrs)
             self._scan = self._scan_emptytag
             return i+1
         elif c.isspace():
             return i+1
         else:
-            self._token.start_attr_key()
+            assert self._attrkey is None, self._attrkey
+            self._attrkey = ''
             self._scan = self._scan_starttag_attr_key
             return i
 
+    def _scan_skip(self, i, c):
+        # Look for the end tag of a skipped/opaque element.
+        (name, keep, endtag) = self._skip
+        buf = self._buf
+        d = len(self._skiptail)
+        if d:
+            # The end tag might have started in the previous input.
+            assert i == 0
+            buf = self._skiptail + buf
+            self._skiptail = ''
+        m = endtag.search(buf, i)
+        if m is not None:
+            j = m.start()
+        else:
+            j = buf.rfind('<', i)
+            if j < 0 or not self.ENDTAG_PREFIX.fullmatch(buf, j):
+                j = len(buf)
+        if keep and i < j:
+            if i < d:
+                self._handle_char(i-d, buf[i:min(j, d)])
+            if d < j:
+                self._handle_span(max(i, d)-d, j-d)
+        if m is None:
+            self._skiptail = buf[j:]
+            return len(self._buf)
+        self._handle_token(j-d, XMLEndTagToken(name, self._pos+j-d))
+        self._skip = None
+        self._scan = self._scan_main
+        return m.end()-d
+
     def _scan_emptytag(self, i, c):
         assert isinstance(self._token, XMLEmptyTagToken), self._token
         if c == '>':
-            self._handle_token(self._token.pos, self._token)
+            self._handle_token(self._token.pos-self._pos, self._token)
             self._token = None
             self._scan = self._scan_main
             return i+1
@@ -567,16 +951,17 @@ class WikiTextTokenizer:
     def _scan_starttag_attr_key(self, i, c):
         assert isinstance(self._token, XMLStartTagToken), self._token
         if c == '=':
-            self._token.start_attr_value()
+            self._attrvalue = ''
             self._scan = self._scan_starttag_attr_value
             return i+1
         elif c == '/' or c == '>' or c.isspace():
-            self._token.end_attr()
+            self._end_attr()
             self._scan = self._scan_starttag_mid
             return i
         else:
-            self._token.add_char(c.lower())
-            return i+1
+            j = self.ATTR_KEY_CHAR.match(self._buf, i).end()
+            self._attrkey += lower(self._buf[i:j])
+            return j
 
     def _scan_starttag_attr_value(self, i, c):
         assert isinstance(self._token, XMLStartTagToken), self._token
@@ -589,56 +974,60 @@ class WikiTextTokenizer:
             self._quote_close = c
             return i+1
         elif c == '&':
-            self._entity = self.XMLEntityContext1(
-                i,
-                self._add_value_char,
-                self._scan_starttag_attr_value)
-            self._scan = self._scan_entity
-            return i+1
+            return self._start_entity(i, self._scan_starttag_attr_value)
         elif c == '/' or c == '>' or c.isspace():
-            self._token.end_attr()
+            self._end_attr()
             self._scan = self._scan_starttag_mid
             return i
         else:
-            self._token.add_char(c)
-            return i+1
+            j = self.ATTR_VALUE_CHAR.match(self._buf, i).end()
+            self._attrvalue += self._buf[i:j]
+            return j
 
     def _scan_starttag_attr_value_quote(self, i, c):
         assert isinstance(self._token, XMLStartTagToken), self._token
         assert self._quote_close is not None
         if c == self._quote_close:
-            self._token.end_attr()
+            self._end_attr()
             self._quote_close = None
             self._scan = self._scan_starttag_mid
             return i+1
         elif c == '&':
-            self._entity = self.XMLEntityContext1(
-                i,
-                self._add_value_char,
-                self._scan_starttag_attr_value_quote)
-            self._scan = self._scan_entity
-            return i+1
+            return self._start_entity(i, self._scan_starttag_attr_value_quote)
         else:
-            self._token.add_char(c)
-            return i+1
+            m = self.ATTR_QUOTE_CHAR[self._quote_close].match(self._buf, i)
+            j = m.end()
+            self._attrvalue += self._buf[i:j]
+            return j
 
     def _add_value_char(self, c):
+        assert self._attrvalue is not None
+        self._attrvalue += c
+        return
+
+    def _end_attr(self):
         assert isinstance(self._token, XMLStartTagToken), self._token
-        self._token.add_char(c)
+        assert self._attrkey is not None
+        if self._attrvalue is None:
+            self._token.set_attr(self._attrkey, self._attrkey)
+        else:
+            self._token.set_attr(self._attrkey, self._attrvalue)
+        self._attrkey = self._attrvalue = None
         return
 
     def _scan_endtag(self, i, c):
         assert isinstance(self._token, XMLEndTagToken), self._token
         if c == '>':
-            self._handle_token(self._token.pos, self._token)
+            self._handle_token(self._token.pos-self._pos, self._token)
             self._token = None
             self._scan = self._scan_main
             return i+1
         elif c.isspace():
             return i+1
         else:
-            self._token.add_char(c.lower())
-            return i+1
+            j = self.ENDTAG_CHAR.match(self._buf, i).end()
+            self._token.add_char(lower(self._buf[i:j]))
+            return j
 
     def _scan_comment(self, i, c):
         if c == '>':
@@ -649,15 +1038,16 @@ class WikiTextTokenizer:
             self._scan = self._scan_comment_h1
             return i+1
         else:
-            self._handle_char(i, c)
-            return i+1
+            j = self.COMMENT_CHAR.match(self._buf, i).end()
+            self._handle_span(i, j)
+            return j
 
     def _scan_comment_h1(self, i, c):
         if c == '-':
             self._scan = self._scan_comment_h2
             return i+1
         else:
-            self._handle_char(i-1, '-')
+            self._handle_prev(i, '-')
             self._scan = self._scan_comment
             return i
 
@@ -666,15 +1056,18 @@ class WikiTextTokenizer:
             self._scan = self._scan_comment_h3
             return i+1
         else:
-            self._handle_char(i, c)
-            return i+1
+            j = self._buf.find('-', i+1)
+            if j < 0:
+                j = len(self._buf)
+            self._handle_span(i, j)
+            return j
 
     def _scan_comment_h3(self, i, c):
         if c == '-':
             self._scan = self._scan_comment
             return i+1
         else:
-            self._handle_char(i-1, '-')
+            self._handle_prev(i, '-')
             self._scan = self._scan_comment_h2
             return i
 
@@ -704,7 +1097,7 @@ class WikiTextTokenizer:
             self._scan = self._scan_main
             return i+1
         else:
-            self._handle_char(i-1, '{')
+            self._handle_prev(i, '{')
             self._scan = self._scan_main
             return i
 
@@ -714,7 +1107,7 @@ class WikiTextTokenizer:
             self._scan = self._scan_main
             return i+1
         else:
-            self._handle_char(i-1, '}')
+            self._handle_prev(i, '}')
             self._scan = self._scan_main
             return i
 
@@ -723,7 +1116,7 @@ class WikiTextTokenizer:
             self._scan = self._scan_q2
             return i+1
         else:
-            self._handle_char(i-1, "'")
+            self._handle_prev(i, "'")
             self._scan = self._scan_main
             return i
 
@@ -732,7 +1125,7 @@ class WikiTextTokenizer:
             self._scan = self._scan_q3
             return i+1
         else:
-            self._handle_token(i-1, WikiToken.QUOTE2)
+            self._handle_token(i-2, WikiToken.QUOTE2)
             self._scan = self._scan_main
             return i
 
@@ -741,7 +1134,7 @@ class WikiTextTokenizer:
             self._scan = self._scan_q4
             return i+1
         else:
-            self._handle_token(i-2, WikiToken.QUOTE3)
+            self._handle_token(i-3, WikiToken.QUOTE3)
             self._scan = self._scan_main
             return i
 
@@ -771,11 +1164,273 @@ class WikiTextTokenizer:
             self._scan = self._scan_main
             return i+1
         else:
-            self._handle_char(i-1, '!')
+            self._handle_prev(i, '!')
             self._scan = self._scan_main
             return i
 
 
+##  WikiTokenArray
+##
+##  Token stream stored in parallel arrays of kinds, start and
+##  end offsets. Token objects are only created when requested.
+##  The arrays can be passed to numpy.frombuffer(a, dtype=numpy.intc).
+##
+class WikiTokenArray:
+
+    TEXT = 0
+    EXTENSION = 1
+    HEADLINE = 2
+    HEADLINE_END = 3
+    ITEMIZE = 4
+    XML_START = 5
+    XML_END = 6
+    XML_EMPTY = 7
+
+    # WikiToken constants are numbered from WIKI.
+    WIKI = 8
+    TOKENS = (
+        WikiToken.EOL,
+        WikiToken.BLANK,
+        WikiToken.BAR,
+        WikiToken.QUOTE2,
+        WikiToken.QUOTE3,
+        WikiToken.QUOTE5,
+        WikiToken.COMMENT_OPEN,
+        WikiToken.COMMENT_CLOSE,
+        WikiToken.SPECIAL_OPEN,
+        WikiToken.SPECIAL_CLOSE,
+        WikiToken.KEYWORD_OPEN,
+        WikiToken.KEYWORD_CLOSE,
+        WikiToken.LINK_OPEN,
+        WikiToken.LINK_CLOSE,
+        WikiToken.TABLE_OPEN,
+        WikiToken.TABLE_CLOSE,
+        WikiToken.TABLE_ROW,
+        WikiToken.TABLE_CAPTION,
+        WikiToken.TABLE_HEADER,
+        WikiToken.TABLE_HEADER_SEP,
+        WikiToken.TABLE_DATA,
+        WikiToken.TABLE_DATA_SEP,
+        WikiToken.HR,
+        WikiToken.PAR,
+        WikiToken.PRE,
+    )
+    KIND = dict(zip(TOKENS, range(WIKI, WIKI+len(TOKENS))))
+    CLASS_KIND = {
+        ExtensionToken: EXTENSION,
+        WikiHeadlineToken: HEADLINE,
+        WikiItemizeToken: ITEMIZE,
+        XMLStartTagToken: XML_START,
+        XMLEndTagToken: XML_END,
+        XMLEmptyTagToken: XML_EMPTY,
+    }
+
+    @classmethod
+    def get_kind(klass, token):
+        return klass.KIND[token]
+
+    def __init__(self, source):
+        self.source = source
+        self.kinds = array('i')
+        self.starts = array('i')
+        self.ends = array('i')
+        # Index of the first entry whose end is not known yet.
+        self.pending = None
+        # Values that cannot be taken from the source.
+        self._values = {}
+        self._tokens = {}
+        self._headline = None
+        return
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {len(self)} tokens>'
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, i):
+        return (self.starts[i], self.get_token(i))
+
+    def __iter__(self):
+        for i in range(len(self.kinds)):
+            yield (self.starts[i], self.get_token(i))
+        return
+
+    def add_text(self, pos, text):
+        if '&' not in text and self.source.startswith(text, pos):
+            self._add(self.TEXT, pos, pos+len(text))
+        else:
+            # Text with character references ends at the next token.
+            self._values[len(self.kinds)] = text
+            self._add(self.TEXT, pos, -1)
+        return
+
+    def add_token(self, pos, token):
+        if self.pending is not None:
+            self.set_end(pos)
+        kind = self.KIND.get(token)
+        if kind is None:
+            kind = self.CLASS_KIND[token.__class__]
+            if kind == self.HEADLINE:
+                if token is self._headline:
+                    kind = self.HEADLINE_END
+                else:
+                    self._headline = token
+            elif kind == self.EXTENSION:
+                self._values[len(self.kinds)] = token
+        self._add(kind, pos, -1)
+        return
+
+    def _add(self, kind, start, end):
+        if end < 0 and self.pending is None:
+            self.pending = len(self.kinds)
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.ends.append(end)
+        return
+
+    def set_end(self, end):
+        for i in range(self.pending, len(self.kinds)):
+            self.ends[i] = max(end, self.starts[i])
+        self.pending = None
+        return
+
+    def get_text(self, i):
+        (start, end) = (self.starts[i], self.ends[i])
+        return self.source[start:end]
+
+    def get_token(self, i):
+        kind = self.kinds[i]
+        if self.WIKI <= kind:
+            return self.TOKENS[kind-self.WIKI]
+        elif i in self._values:
+            return self._values[i]
+        elif kind == self.TEXT:
+            return self.get_text(i)
+        elif i in self._tokens:
+            return self._tokens[i]
+        elif kind == self.HEADLINE_END:
+            # Same token as the headline that it closes.
+            j = i-1
+            while self.kinds[j] != self.HEADLINE:
+                j -= 1
+            return self.get_token(j)
+        elif kind == self.HEADLINE:
+            token = WikiHeadlineToken(self.get_text(i), self.starts[i])
+        elif kind == self.ITEMIZE:
+            token = WikiItemizeToken(self.get_text(i), self.starts[i])
+        else:
+            # XML tags are tokenized again.
+            tokenizer = _WikiTokenCollector()
+            tokenizer.feed_text(self.get_text(i))
+            tokenizer.close()
+            (token,) = tokenizer.tokens
+            token.pos = self.starts[i]
+        self._tokens[i] = token
+        return token
+
+##  Transition table
+##
+##  The table is compiled by running each state in DFA_STATES with
+##  each character in DFA_CHARS and recording what the state does.
+##  Actions that depend on anything other than the character (the
+##  following input or other tokenizer state) are marked as False
+##  and are left to the state method.
+##  Under CPython this is slower than the state methods alone, as
+##  text runs and tags are still left to them, so it is only used
+##  with dfa=True.
+##
+class _WikiDFAProbe(WikiTextTokenizer):
+
+    def __init__(self, wiki, line_token):
+        WikiTextTokenizer.__init__(self)
+        self._wiki = wiki
+        self._line_token = line_token
+        self.calls = []
+        return
+
+    def _handle_token(self, i, token):
+        self.calls.append(('_handle_token', i-1, token))
+        return
+    def _handle_char(self, i, c):
+        self.calls.append(('_handle_char', i-1, c))
+        return
+    def _handle_prev(self, i, c):
+        self.calls.append(('_handle_prev', i-1, c))
+        return
+    def _handle_span(self, i, j):
+        self.calls.append(('_handle_run', i-1, j-i))
+        return
+
+    def run(self, name, c, follow):
+        self._buf = '-'+c+follow
+        self._scan = getattr(self, name)
+        state = vars(self).copy()
+        try:
+            i = getattr(self, name)(1, c)
+        except AssertionError:
+            return False
+        for (k,v) in vars(self).items():
+            if k != '_scan' and state[k] != v:
+                return False
+        return (tuple(self.calls), self._scan.__name__, i-1)
+
+def compile_dfa(wiki):
+    table = {}
+    for name in WikiTextTokenizer.DFA_STATES:
+        row = {}
+        for c in WikiTextTokenizer.DFA_CHARS:
+            actions = set()
+            for follow in ('', 'a', '\n', '-'):
+                for line_token in (None, WikiHeadlineToken('=')):
+                    probe = _WikiDFAProbe(wiki, line_token)
+                    actions.add(probe.run(name, c, follow))
+            if len(actions) == 1:
+                row[c] = actions.pop()
+            else:
+                row[c] = False
+        table[getattr(WikiTextTokenizer, name)] = row
+    return table
+
+_DFA = None
+def get_dfa():
+    global _DFA
+    if _DFA is None:
+        _DFA = { True: compile_dfa(True), False: compile_dfa(False) }
+    return _DFA
+
+def parse_xml_attrs(rawattrs):
+    collector = _WikiAttrCollector()
+    collector.feed_text('<a'+rawattrs+'>')
+    collector.close()
+    return collector.attrs
+
+class _WikiAttrCollector(WikiTextTokenizer):
+
+    LAZY_ATTRS = False
+
+    def __init__(self):
+        WikiTextTokenizer.__init__(self)
+        self.attrs = None
+        return
+
+    def handle_token(self, pos, token):
+        if isinstance(token, XMLTagToken):
+            self.attrs = token.attrs
+        return
+
+class _WikiTokenCollector(WikiTextTokenizer):
+
+    def __init__(self):
+        WikiTextTokenizer.__init__(self)
+        self.tokens = []
+        return
+
+    def handle_token(self, pos, token):
+        self.tokens.append(token)
+        return
+
+
 # main
 def main(argv):
     from utils import getfp
@@ -791,7 +1446,7 @@ def main(argv):
         print(path, file=sys.stderr)
         (_,fp) = getfp(path)
         tokenizer = Tokenizer()
-        tokenizer.feed_file(fp)
+        tokenizer.feed_file(fp, blocksize=65536)
         tokenizer.close()
         fp.close()
     return
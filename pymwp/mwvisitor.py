@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+import sys
+from .mwparser import WikiTextParser
+
+
+##  WikiVisitor
+##
+##  Walks a tree without recursion.
+##  For each node, visit_<Class> of the first class in its MRO
+##  that has one is called (e.g. visit_WikiKeywordTree, visit_str,
+##  visit_WikiToken, and visit_object for anything else).
+##  The methods are looked up once per node class.
+##
+##  A visit method returns None, or the nodes to visit next.
+##  A generator method can also do something between and after
+##  its nodes:
+##
+##    def visit_WikiDivTree(self, tree):
+##        yield from tree
+##        self.texts.append('\n')
+##
+class WikiVisitor:
+
+    def visit(self, tree):
+        methods = self._get_methods()
+        stack = [iter((tree,))]
+        while stack:
+            for node in stack[-1]:
+                klass = node.__class__
+                try:
+                    method = methods[klass]
+                except KeyError:
+                    method = methods[klass] = self._find_method(klass)
+                nodes = method(self, node)
+                if nodes is not None:
+                    stack.append(iter(nodes))
+                    break
+            else:
+                stack.pop()
+        return
+
+    def visit_WikiTree(self, tree):
+        return tree
+
+    def visit_object(self, obj):
+        return None
+
+    @classmethod
+    def _get_methods(klass):
+        # Each visitor class has its own table.
+        methods = klass.__dict__.get('_methods')
+        if methods is None:
+            methods = {}
+            klass._methods = methods
+        return methods
+
+    @classmethod
+    def _find_method(klass, nodeclass):
+        for c in nodeclass.__mro__:
+            method = getattr(klass, 'visit_'+c.__name__, None)
+            if method is not None: break
+        return method
+
+
+# main
+def main(argv):
+    from utils import getfp
+    class Counter(WikiVisitor):
+        def __init__(self):
+            self.counts = {}
+            return
+        def count(self, obj):
+            name = obj.__class__.__name__
+            self.counts[name] = self.counts.get(name, 0)+1
+            return
+        def visit_WikiTree(self, tree):
+            self.count(tree)
+            return tree
+        def visit_object(self, obj):
+            self.count(obj)
+            return None
+    args = argv[1:] or ['-']
+    for path in args:
+        print(path, file=sys.stderr)
+        (_,fp) = getfp(path)
+        parser = WikiTextParser()
+        parser.feed_file(fp, blocksize=65536)
+        parser.close()
+        fp.close()
+        counter = Counter()
+        counter.visit(parser.get_root())
+        for (name,n) in sorted(counter.counts.items()):
+            print(f'{n}\t{name}')
+    return
+
+if __name__ == '__main__': sys.exit(main(sys.argv))
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+import unittest
+from pymwp.mwparser import WikiTree
+from pymwp.mwparser import WikiTextParser
+from pymwp.mwarena import WikiArenaParser
+
+
+TEXT = """== a ==
+b [[c|d|e]] f {{g|h|i=j}}<div class="k">l '''m'''</div>
+{|
+| n || o
+|}
+"""
+
+def parse(klass, text):
+    parser = klass()
+    parser.feed_text(text)
+    parser.close()
+    return parser.get_root()
+
+def dump(x):
+    if not isinstance(x, WikiTree):
+        return x
+    return (x.__class__.__name__, x.get_text(), len(x),
+            [ dump(x[i]) for i in range(len(x)) ],
+            [ dump(x[i]) for i in range(-1, -len(x)-1, -1) ])
+
+
+##  TestArena
+##
+class TestArena(unittest.TestCase):
+
+    def test_same_tree(self):
+        self.assertEqual(dump(parse(WikiArenaParser, TEXT)),
+                         dump(parse(WikiTextParser, TEXT)))
+        return
+
+    def test_index(self):
+        root = parse(WikiArenaParser, TEXT)
+        n = len(root)
+        self.assertEqual(len(list(root)), n)
+        self.assertEqual(len(root[1:]), n-1)
+        with self.assertRaises(IndexError):
+            root[n]
+        with self.assertRaises(IndexError):
+            root[-n-1]
+        return
+
+
+if __name__ == '__main__': unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+import os
+import shutil
+import tempfile
+import unittest
+from pymwp.mwparser import WikiTextParser
+from pymwp.mwcache import WikiParseCache
+from tests.test_parse_trees import dump
+
+
+TEXTS = [ f'== {i} ==\n[[a|b]] {{{{c|{i}}}}}\n' for i in range(5) ]
+
+def parse(text):
+    parser = WikiTextParser()
+    parser.feed_text(text)
+    parser.close()
+    return parser.get_root()
+
+
+##  TestParseCache
+##
+class TestParseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.path = os.path.join(self.dirname, 'cache.db')
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+        return
+
+    def test_batch(self):
+        # Trees are seen from another connection before close().
+        cache1 = WikiParseCache(path=self.path, batchsize=2)
+        for text in TEXTS:
+            cache1.put(text, parse(text))
+        cache2 = WikiParseCache(path=self.path)
+        for text in TEXTS[:4]:
+            self.assertEqual(dump(cache2.get(text)), dump(parse(text)))
+        self.assertEqual(cache2.disk_hits, 4)
+        self.assertIsNone(cache2.get(TEXTS[4]))
+        cache1.close()
+        self.assertEqual(dump(cache2.get(TEXTS[4])), dump(parse(TEXTS[4])))
+        cache2.close()
+        return
+
+    def test_gzipped(self):
+        with WikiParseCache(path=self.path, gzipped=True) as cache:
+            cache.parse(TEXTS[0])
+        with WikiParseCache(path=self.path, gzipped=True) as cache:
+            self.assertEqual(dump(cache.get(TEXTS[0])), dump(parse(TEXTS[0])))
+            self.assertEqual(cache.disk_hits, 1)
+        return
+
+
+if __name__ == '__main__': unittest.main()
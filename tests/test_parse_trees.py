@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#
+# Compares parse trees with those of the parser before its states
+# were dispatched through tables (commit 8f8cb76), kept as digests
+# in parse_trees.json. To record them again with another version:
+#  $ PYTHONPATH=<tree> python tests/test_parse_trees.py -o tests/parse_trees.json
+#
+import os
+import sys
+import json
+import random
+import hashlib
+import unittest
+from pymwp.mwtokenizer import Token
+from pymwp.mwtokenizer import WikiToken
+from pymwp.mwtokenizer import XMLTagToken
+from pymwp.mwparser import WikiTree
+from pymwp.mwparser import WikiTextParser
+from pymwp.mwparser import WikiParserError
+
+DIGESTS = os.path.join(os.path.dirname(__file__), 'parse_trees.json')
+
+FIXED = [
+    # Wiki tables.
+    '{|\n| a || b\n|-\n| c\n|}\n',
+    '{| class="x"\n|+ cap\n! h1 !! h2\n|-\n| a | b || c\n|}',
+    '{|\n| a\n{|\n| nested\n|}\n| b\n|}\n',
+    '{|\n|-\n| a\n|-\n|}\nafter',
+    '{|\n| a\n',
+    '|}\n| b\n|-\n',
+    '{|\n! h\n| d\n|+ late caption\n|}',
+    # XML tables, rows and paragraphs.
+    '<table><tr><td>a</td><td>b</td></tr></table>',
+    '<table><tr><td>a<td>b<tr><td>c</table>after',
+    '<table><tr><td><table><tr><td>x</td></tr></table>y</td></tr></table>',
+    '<p>a<p>b</p>c</p>',
+    '<div>a<p>b</div>c</p>',
+    '<table><tr><td><p>a</td></tr></table>',
+    '<tr><td>a</td></tr></table>',
+    '<table><p>a<tr>b</p></tr></table>',
+    '<li>a<li>b</li><dd>c<dt>d</dt>',
+    '<h2>a<div>b</h2>c</div>',
+    '<table>\n{|\n| a <tr>b</tr>\n|}\n</table>',
+    '{|\n| <table><tr><td>a\n|}\n</td></tr></table>',
+    '<blockquote><center><address>a</address></center></blockquote>',
+    # Lines.
+    '== a ==\nb\n=== c ===\n= d\nx = y\n',
+    '* a\n** b\n#: c\n; d : e\n----\n pre\n more\n\npar',
+    ' pre [[a]] {{b}}\n* item {{c|\nd}}\n',
+    # Spans.
+    "''a'''b'''c'' '''''d''''' ''''e''''",
+    '[[a|b|c]] [[d]] ]] [ [[ [http://x y] [z]',
+    '{{a|b=c|d|e={{f|g}}}} }} } {{{1}}} {{{{x}}}}',
+    '<!-- a -- b --> c <!-- unclosed',
+    '<nowiki>[[a]] {{b}} &lt;</nowiki> <source>{{c}}</source>',
+    '<ref name=a/>x<ref>y {{z}}</ref><gallery>\nA.jpg|b\n</gallery>',
+    '<span a="b" c=d>e</span><br/><br><hr />',
+    '&amp; &#65; &#x41; &bogus; &#; &',
+    # Unclosed and stray.
+    '[[a\n{{b\n<div>c\n{| d\n| e\n',
+    '</div></table></tr></td></p>',
+    "'''a\n''b\n",
+]
+
+TOKENS = [
+    '&amp;', '&#65;', '<ref>', '</ref>', '<nowiki>', '</nowiki>',
+    '<table>', '</table>', '<tr>', '</tr>', '<td>', '</td>', '<th>',
+    '<p>', '</p>', '<div a="b">', '</div>', '<li>', '<br/>',
+    '<!--', '-->', '{{', '}}', '[[', ']]', '[', ']', '{|', '|}', '|-',
+    '|+', '\n|', '\n!', '||', '!!', '|', '\n==', '==\n', "'''", "''",
+    '\n*', '\n#', '\n:', '\n;', '\n ', '\n----', '\n\n', '\n',
+    'word ', 'text', ' ', '=', 'x',
+]
+
+def fuzz(seed, n=300):
+    r = random.Random(seed)
+    out = []
+    while sum(map(len, out)) < n:
+        out.append(r.choice(TOKENS))
+    return ''.join(out)
+
+def get_inputs():
+    inputs = [ (f'fixed{i}', text) for (i,text) in enumerate(FIXED) ]
+    inputs.extend( (f'fuzz{i}', fuzz(i)) for i in range(300) )
+    return inputs
+
+def dump(x):
+    if isinstance(x, str):
+        return x
+    if isinstance(x, Token):
+        d = [x.__class__.__name__, x.name]
+        if isinstance(x, XMLTagToken):
+            d.append(sorted(x.attrs.items()))
+        if hasattr(x, 'pos'):
+            d.append(x.pos)
+        return d
+    assert isinstance(x, WikiTree), x
+    d = [x.__class__.__name__]
+    for name in ('token', 'xml'):
+        if name in vars(x):
+            d.append(dump(getattr(x, name)))
+    d.append([ dump(c) for c in x ])
+    return d
+
+def get_digest(text, chunk=None, **kwargs):
+    parser = WikiTextParser(**kwargs)
+    parser.invalid_token = (lambda pos, token: None)
+    try:
+        if chunk is None:
+            parser.feed_text(text)
+        else:
+            for i in range(0, len(text), chunk):
+                parser.feed_text(text[i:i+chunk])
+        parser.close()
+        data = dump(parser.get_root())
+    except WikiParserError as e:
+        data = e.__class__.__name__
+    data = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+##  TestParseTrees
+##
+class TestParseTrees(unittest.TestCase):
+
+    def setUp(self):
+        with open(DIGESTS) as fp:
+            self.digests = json.load(fp)
+        return
+
+    def test_same_trees(self):
+        inputs = get_inputs()
+        self.assertEqual(len(inputs), len(self.digests))
+        for (name, text) in inputs:
+            self.assertEqual(get_digest(text), self.digests[name], name)
+        return
+
+    def test_chunks(self):
+        # Trees do not depend on how the text is fed.
+        for (name, text) in get_inputs():
+            self.assertEqual(get_digest(text, chunk=7), self.digests[name], name)
+        return
+
+    def test_dfa(self):
+        for (name, text) in get_inputs():
+            self.assertEqual(get_digest(text, dfa=True), self.digests[name], name)
+        return
+
+
+# main
+def main(argv):
+    import getopt
+    (opts, args) = getopt.getopt(argv[1:], 'o:')
+    path = DIGESTS
+    for (k, v) in opts:
+        if k == '-o': path = v
+    digests = { name: get_digest(text) for (name, text) in get_inputs() }
+    with open(path, 'w') as fp:
+        json.dump(digests, fp, indent=0, sort_keys=True)
+        fp.write('\n')
+    return
+
+if __name__ == '__main__': sys.exit(main(sys.argv))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+import unittest
+from pymwp.mwparser import WikiTree
+from pymwp.mwparser import WikiArgTree
+from pymwp.mwparser import WikiTextParser
+from tests.test_parse_trees import dump
+from tests.test_parse_trees import fuzz
+
+
+def parse(text, **kwargs):
+    parser = WikiTextParser(**kwargs)
+    parser.feed_text(text)
+    parser.close()
+    return parser.get_root()
+
+def get_text(tree):
+    # get_text() without the caches.
+    return ''.join( x if isinstance(x, str) else get_text(x)
+                    for x in tree if isinstance(x, (str, WikiTree)) )
+
+
+##  TestGetText
+##
+class TestGetText(unittest.TestCase):
+
+    def test_text(self):
+        root = parse("a ''b'' [[c|d]] {{e|f}}\n* g\n")
+        self.assertEqual(root.get_text(), get_text(root))
+        self.assertEqual(root.get_text(), get_text(root))
+        return
+
+    def test_open(self):
+        # Trees still being parsed are read as they are.
+        parser = WikiTextParser()
+        parser.feed_text('x [[a|b')
+        root = parser.get_root()
+        link = root[-1]
+        self.assertEqual(link.get_text(), get_text(link))
+        self.assertEqual(root.get_text(), get_text(root))
+        self.assertIsNone(link._textcache)
+        parser.feed_text('c]] y {{d}} z\n')
+        self.assertEqual(link.get_text(), 'abc')
+        self.assertEqual(root.get_text(), get_text(root))
+        parser.close()
+        self.assertEqual(root.get_text(), 'xabcydz')
+        return
+
+    def test_finished(self):
+        # The cache of a finished tree is kept while parsing goes on.
+        parser = WikiTextParser()
+        parser.feed_text('[[a]] b ')
+        link = parser.get_root()[0]
+        self.assertEqual(link.get_text(), 'a')
+        self.assertEqual(link._textcache, 'a')
+        parser.feed_text('c [[d]]\n')
+        parser.close()
+        self.assertEqual(link._textcache, 'a')
+        return
+
+    def test_append(self):
+        # Finished trees are not changed, so no cache above is stale.
+        root = parse('x [[a|b]] y')
+        self.assertEqual(root.get_text(), 'xaby')
+        link = root[2]
+        self.assertEqual(link.get_text(), 'ab')
+        with self.assertRaises(AssertionError):
+            link[1].append('ZZ')
+        self.assertEqual(root.get_text(), get_text(root))
+        self.assertEqual(link.get_text(), get_text(link))
+        return
+
+    def test_new_tree(self):
+        # Trees not made by a parser can be appended to.
+        root = WikiTree()
+        arg = WikiArgTree()
+        root.append('a')
+        root.append(arg)
+        self.assertEqual(root.get_text(), 'a')
+        arg.append('b')
+        self.assertEqual(root.get_text(), 'ab')
+        root.append('c')
+        self.assertEqual(root.get_text(), 'abc')
+        self.assertIsNone(root._textcache)
+        return
+
+    def test_checkpoint(self):
+        text = "a [[b\n{{c|\nd}} e\n''f''\n"
+        parser = WikiTextParser(checkpoint_interval=1)
+        parser.feed_text(text)
+        root = parser.get_root()
+        self.assertEqual(root.get_text(), get_text(root))
+        checkpoint = parser.get_checkpoint(len(text)//2)
+        parser.restore_checkpoint(checkpoint)
+        self.assertEqual(root.get_text(), get_text(root))
+        parser.feed_text(text[checkpoint.pos:])
+        parser.close()
+        self.assertEqual(root.get_text(), parse(text).get_text())
+        return
+
+
+##  TestCheckpoints
+##
+class TestCheckpoints(unittest.TestCase):
+
+    INSERTS = ['\n\nC\n', '\n', 'x', '\n* a', '{{b\n', '|}\n', "''"]
+
+    def edit(self, text, pos, s):
+        # Resumes from the checkpoint for an edit at pos.
+        parser = WikiTextParser(checkpoint_interval=1)
+        parser.invalid_token = (lambda pos, token: None)
+        parser.feed_text(text)
+        text = text[:pos]+s+text[pos:]
+        checkpoint = parser.get_checkpoint(pos)
+        if checkpoint is not None:
+            parser.restore_checkpoint(checkpoint)
+            text = text[checkpoint.pos:]
+        else:
+            parser = WikiTextParser(checkpoint_interval=1)
+            parser.invalid_token = (lambda pos, token: None)
+        parser.feed_text(text)
+        parser.close()
+        return dump(parser.get_root())
+
+    def full(self, text):
+        parser = WikiTextParser()
+        parser.invalid_token = (lambda pos, token: None)
+        parser.feed_text(text)
+        parser.close()
+        return dump(parser.get_root())
+
+    def test_blank_line(self):
+        text = 'A\n\nB\n'
+        new = 'A\n\n\n\nC\nB\n'
+        self.assertEqual(self.edit(text, 3, '\n\nC\n'), self.full(new))
+        return
+
+    def test_edits(self):
+        # Edits at the checkpoint offsets.
+        for seed in range(50):
+            text = fuzz(seed, 120)
+            parser = WikiTextParser(checkpoint_interval=1)
+            parser.invalid_token = (lambda pos, token: None)
+            parser.feed_text(text)
+            for checkpoint in parser.checkpoints:
+                pos = checkpoint.pos
+                for s in self.INSERTS:
+                    new = text[:pos]+s+text[pos:]
+                    self.assertEqual(self.edit(text, pos, s), self.full(new),
+                                     (seed, pos, s))
+        return
+
+
+if __name__ == '__main__': unittest.main()
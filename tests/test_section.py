@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+import unittest
+from pymwp.mwparser import WikiTextParser
+from pymwp.mwparser import WikiParserLimitExceeded
+from pymwp.mwsection import WikiSectionParser
+from pymwp.mwsection import WikiParallelParser
+from tests.test_parse_trees import dump
+
+
+TEXT = '''intro [[a]]
+
+para one {{b|
+c}}
+
+== d ==
+para two
+{|
+| e
+
+| f
+|}
+
+para three
+'''
+
+def parse(text, **kwargs):
+    parser = WikiTextParser(**kwargs)
+    parser.feed_text(text)
+    parser.close()
+    return parser.get_root()
+
+
+##  TestSectionParser
+##
+class TestSectionParser(unittest.TestCase):
+
+    def test_revisions(self):
+        parser = WikiSectionParser()
+        texts = [TEXT, TEXT.replace('para two', 'para 2'), TEXT+'== g ==\nh\n']
+        for text in texts:
+            self.assertEqual(dump(parser.parse(text)), dump(parse(text)))
+        self.assertLess(0, parser.reused)
+        return
+
+
+##  TestParallelParser
+##
+class TestParallelParser(unittest.TestCase):
+
+    def test_no_pool(self):
+        # Pages are parsed here when there is no pool.
+        text = 'para one\n\npara two\n\npara three\n'
+        parser = WikiParallelParser(workers=2, piecesize=3)
+        parser._broken = True
+        self.assertLess(1, len(parser.get_starts(text)))
+        self.assertEqual(parser.parse(text).get_text(), parse(text).get_text())
+        for piecesize in (1, 5, 20):
+            parser.piecesize = piecesize
+            self.assertEqual(dump(parser.parse(TEXT)), dump(parse(TEXT)))
+        return
+
+    def test_pool(self):
+        with WikiParallelParser(workers=2, piecesize=5) as parser:
+            self.assertEqual(dump(parser.parse(TEXT)), dump(parse(TEXT)))
+            self.assertIsNone(parser.exceeded)
+        return
+
+    def test_limits(self):
+        # Limits apply to the whole page as in a full parse, with or
+        # without a pool.
+        text = ''.join( f'para {i} [[a]] {{{{b}}}}\n\n' for i in range(20) )
+        for broken in (False, True):
+            for limits in (dict(maxtokens=150), dict(maxnodes=30)):
+                full = WikiTextParser(degrade=True, **limits)
+                full.feed_text(text)
+                full.close()
+                self.assertIsNotNone(full.exceeded)
+                with WikiParallelParser(workers=2, piecesize=40, degrade=True,
+                                        **limits) as parser:
+                    parser._broken = broken
+                    self.assertLess(1, len(parser.get_starts(text)))
+                    root = parser.parse(text)
+                    self.assertEqual(dump(root), dump(full.get_root()))
+                    self.assertEqual(parser.exceeded.limit, full.exceeded.limit)
+                    self.assertEqual(parser.exceeded.pos, full.exceeded.pos)
+                with WikiParallelParser(workers=2, piecesize=40,
+                                        **limits) as parser:
+                    parser._broken = broken
+                    with self.assertRaises(WikiParserLimitExceeded) as cm:
+                        parser.parse(text)
+                    self.assertEqual(cm.exception.pos, full.exceeded.pos)
+            with WikiParallelParser(workers=2, piecesize=40, maxtokens=1000,
+                                    degrade=True) as parser:
+                parser._broken = broken
+                self.assertEqual(dump(parser.parse(text)), dump(parse(text)))
+                self.assertIsNone(parser.exceeded)
+        return
+
+    def test_unused_piece(self):
+        # A piece over the limits on its own is not used when the
+        # one before it leaves a comment open.
+        text = ('a <!--\n\n' +
+                ''.join( f'[[{i}]] {{{{b}}}}\n\n' for i in range(10) ) +
+                '-->\n\nc\n')
+        tree = parse(text, maxnodes=5)
+        with WikiParallelParser(workers=2, piecesize=20,
+                                maxnodes=5) as parser:
+            self.assertEqual(dump(parser.parse(text)), dump(tree))
+            self.assertIsNone(parser.exceeded)
+            self.assertLess(0, parser.fallbacks)
+        return
+
+
+if __name__ == '__main__': unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+import unittest
+from pymwp.mwtokenizer import WikiToken
+from pymwp.mwtokenizer import WikiTextTokenizer
+from pymwp.mwtemplate import WikiTemplateParser
+from pymwp.mwdb import WikiDB
+
+
+TEXT = ("x ''{{lang|fr|''texte''}}'' y\n"
+        "{{foo|x|'''y'''|a=''b''|c='''d''' e|'''''f'''''}}\n")
+
+TEMPLATES = [
+    ('Lang', ['fr', "''texte''"], {}),
+    ('Foo', ['x', "'''y'''", "'''''f'''''"], {'a': "''b''", 'c': "'''d''' e"}),
+]
+
+def parse(text, chunk=None):
+    parser = WikiTemplateParser()
+    if chunk is None:
+        parser.feed_text(text)
+    else:
+        for i in range(0, len(text), chunk):
+            parser.feed_text(text[i:i+chunk])
+    parser.close()
+    return parser.templates
+
+
+##  TestQuotes
+##
+class TestQuotes(unittest.TestCase):
+
+    class Tokenizer(WikiTextTokenizer):
+        def __init__(self):
+            WikiTextTokenizer.__init__(self)
+            self.tokens = []
+            return
+        def handle_token(self, pos, token):
+            self.tokens.append((pos, token))
+            return
+        def handle_text(self, pos, text):
+            return
+
+    def test_positions(self):
+        text = "a''b'''c'''''d''e'''"
+        for chunk in (1, 2, len(text)):
+            tokenizer = self.Tokenizer()
+            for i in range(0, len(text), chunk):
+                tokenizer.feed_text(text[i:i+chunk])
+            tokenizer.feed_text('\n')
+            quotes = [ (pos, t) for (pos, t) in tokenizer.tokens
+                       if t in (WikiToken.QUOTE2, WikiToken.QUOTE3,
+                                WikiToken.QUOTE5) ]
+            self.assertEqual(len(quotes), 5)
+            for (pos, t) in quotes:
+                self.assertEqual(text[pos:pos+len(t.name)], t.name)
+                self.assertNotEqual(text[pos-1:pos], "'")
+        return
+
+
+##  TestTemplateParser
+##
+class TestTemplateParser(unittest.TestCase):
+
+    def test_quotes(self):
+        for chunk in (None, 1, 5):
+            templates = parse(TEXT, chunk)
+            self.assertEqual([ (t.name, t.args, t.named) for t in templates ],
+                             TEMPLATES)
+            for t in templates:
+                self.assertTrue(TEXT[t.start:t.end].startswith('{{'))
+                self.assertTrue(TEXT[t.start:t.end].endswith('}}'))
+        return
+
+
+##  TestTemplateDB
+##
+class TestTemplateDB(unittest.TestCase):
+
+    def test_quotes(self):
+        db = WikiDB(':memory:')
+        db.add_page(1, 'A')
+        db.add_templates(1, 2, '', parse(TEXT))
+        templates = db.get_templates(2)
+        self.assertEqual([ (t.name, t.args, t.named) for t in templates ],
+                         TEMPLATES)
+        self.assertEqual(list(db.find_templates('foo', 'c')),
+                         [(1, 2, 30, 79)])
+        db.close()
+        return
+
+
+if __name__ == '__main__': unittest.main()
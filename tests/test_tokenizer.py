@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+import sys
+import copy
+import pickle
+import platform
+import unittest
+from pymwp.mwtokenizer import WikiToken
+from pymwp.mwtokenizer import WikiBOLToken
+from pymwp.mwtokenizer import WikiHeadlineToken
+from pymwp.mwtokenizer import WikiItemizeToken
+from pymwp.mwtokenizer import XMLTagToken
+from pymwp.mwtokenizer import XMLStartTagToken
+from pymwp.mwtokenizer import XMLEndTagToken
+from pymwp.mwtokenizer import XMLEmptyTagToken
+from pymwp.mwtokenizer import WikiTextTokenizer
+from pymwp.mwparser import WikiTextParser
+from tests.test_parse_trees import dump
+from tests.test_parse_trees import get_inputs
+
+
+##  TokenCollector
+##
+class TokenCollector(WikiTextTokenizer):
+
+    def __init__(self, **kwargs):
+        WikiTextTokenizer.__init__(self, **kwargs)
+        self.tokens = []
+        return
+
+    def handle_token(self, pos, token):
+        self.tokens.append(token)
+        return
+
+    def handle_text(self, pos, text):
+        self.tokens.append(text)
+        return
+
+def tokenize(chunks, **kwargs):
+    tokenizer = TokenCollector(**kwargs)
+    for text in chunks:
+        tokenizer.feed_text(text)
+    tokenizer.close()
+    return tokenizer
+
+def names(tokens):
+    return [ t if isinstance(t, str) else t.name for t in tokens ]
+
+def parse(text):
+    parser = WikiTextParser()
+    parser.feed_text(text)
+    parser.close()
+    return parser.get_root()
+
+def leaves(tree):
+    for x in tree:
+        if not hasattr(x, '_subtree'):
+            yield x
+        else:
+            # The start tag of a WikiXMLTree.
+            if getattr(x, 'xml', None) is not None:
+                yield x.xml
+            yield from leaves(x)
+    return
+
+
+##  TestTokenMemory
+##
+##  The sizes documented above Token (CPython, 64-bit).
+##
+class TestTokenMemory(unittest.TestCase):
+
+    TOKENS = (
+        (WikiToken('x'), 40),
+        (WikiHeadlineToken('==', 1), 48),
+        (WikiItemizeToken('*', 1), 48),
+        (XMLStartTagToken('p', 1), 64),
+        (XMLEndTagToken('p', 1), 64),
+        (XMLEmptyTagToken('br', 1), 64),
+    )
+
+    def test_no_dict(self):
+        for (t, _) in self.TOKENS:
+            self.assertFalse(hasattr(t, '__dict__'), t)
+        return
+
+    @unittest.skipUnless(
+        platform.python_implementation() == 'CPython' and
+        sys.maxsize == 2**63-1, 'sizes are for 64-bit CPython')
+    def test_size(self):
+        for (t, size) in self.TOKENS:
+            self.assertLessEqual(sys.getsizeof(t), size, t)
+        return
+
+    def test_no_attrs_dict(self):
+        t = XMLEmptyTagToken('br', 1)
+        self.assertIsNone(t._attrs)
+        self.assertEqual(t.get_attr('a', 'x'), 'x')
+        self.assertIsNone(t._attrs)
+        return
+
+
+##  TestTokenAttrs
+##
+class TestTokenAttrs(unittest.TestCase):
+
+    def test_lazy(self):
+        (t,) = [ x for x in leaves(parse('<div class="a" ID=b>x</div>'))
+                 if isinstance(x, XMLStartTagToken) ]
+        self.assertIsNotNone(t._rawattrs)
+        self.assertEqual(t.get_attr('class'), 'a')
+        self.assertEqual(t.attrs, {'class': 'a', 'id': 'b'})
+        return
+
+    def test_writable(self):
+        t = XMLStartTagToken('p', 1)
+        t.attrs['class'] = 'a'
+        self.assertEqual(t.get_attr('class'), 'a')
+        t.attrs = {'id': 'b'}
+        self.assertEqual(t.attrs, {'id': 'b'})
+        return
+
+
+##  TestTokenPickle
+##
+class TestTokenPickle(unittest.TestCase):
+
+    TEXT = 'a<br>b<div class="c">d</div>{{e|f}}\n== g ==\n* h\n'
+
+    def check(self, tree):
+        orig = list(leaves(parse(self.TEXT)))
+        copied = list(leaves(tree))
+        self.assertEqual(len(orig), len(copied))
+        for (x, y) in zip(orig, copied):
+            self.assertEqual(x.__class__, y.__class__)
+            if isinstance(x, str):
+                self.assertEqual(x, y)
+            else:
+                self.assertEqual(x.name, y.name)
+            if isinstance(x, WikiToken) and x.__class__ in (WikiToken, WikiBOLToken):
+                # Shared tokens are compared with is.
+                self.assertIs(x, y)
+            if isinstance(x, XMLTagToken):
+                self.assertEqual(x.pos, y.pos)
+                self.assertEqual(x.attrs, y.attrs)
+        return
+
+    def test_pickle(self):
+        tree = parse(self.TEXT)
+        self.check(pickle.loads(pickle.dumps(tree)))
+        return
+
+    def test_deepcopy(self):
+        self.check(copy.deepcopy(parse(self.TEXT)))
+        return
+
+
+##  TestSkipTags
+##
+class TestSkipTags(unittest.TestCase):
+
+    def test_skip(self):
+        tokenizer = tokenize(["a<ref>''b''</REF >c"], skip_tags=('ref',))
+        self.assertEqual(names(tokenizer.tokens), ['a', 'ref', 'ref', 'c'])
+        return
+
+    def test_opaque(self):
+        tokenizer = tokenize(["<math>''b''&amp;</math>"], opaque_tags=('math',))
+        self.assertEqual(tokenizer.tokens[1], "''b''&amp;")
+        return
+
+    def test_chunks(self):
+        text = "a<ref>''b''</ref>c<ref>d</ref>"
+        whole = names(tokenize([text], skip_tags=('ref',)).tokens)
+        for n in range(1, 8):
+            chunks = [ text[i:i+n] for i in range(0, len(text), n) ]
+            tokenizer = tokenize(chunks, skip_tags=('ref',))
+            self.assertEqual(names(tokenizer.tokens), whole)
+        return
+
+    def test_nowiki(self):
+        # A tag inside nowiki does not skip over </nowiki>.
+        tokenizer = tokenize(
+            ["<nowiki><ref></nowiki>'''b'''"], skip_tags=('ref',))
+        self.assertTrue(tokenizer._wiki)
+        self.assertIs(tokenizer.tokens[-2], WikiToken.QUOTE3)
+        return
+
+    def test_default(self):
+        tokenizer = tokenize(["a<ref>''b''</ref>"])
+        self.assertIn(WikiToken.QUOTE2, tokenizer.tokens)
+        return
+
+
+##  TestDFA
+##
+class TestDFA(unittest.TestCase):
+
+    # Characters that are not in DFA_CHARS.
+    SPACES = [
+        ('tab', '\t a\n\t\n{|\t\n|\tb\t||\tc\n|-\t\n|}\t\n'),
+        ('nbsp', '\u3000x ==\u00a0y\u3000==\n* \u2003z\n\u00a0\n'),
+    ]
+
+    def test_same_tokens(self):
+        # Token for token, with the input fed at once and in chunks.
+        for (name, text) in get_inputs()+self.SPACES:
+            for n in (len(text), 1, 7):
+                chunks = [ text[i:i+n] for i in range(0, len(text), n) ]
+                tokens1 = tokenize(chunks).tokens
+                tokens2 = tokenize(chunks, dfa=True).tokens
+                self.assertEqual([ dump(t) for t in tokens2 ],
+                                 [ dump(t) for t in tokens1 ], (name, n))
+        return
+
+
+if __name__ == '__main__': unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+import os
+import sys
+import bz2
+import shutil
+import tempfile
+import unittest
+from pymwp.mwparser import WikiTextParser
+from pymwp.mwdb import WikiDB
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tools'))
+import mwwiki2txt
+import mwxml2wiki
+
+
+DUMP = """<mediawiki>
+<page>
+<title>A</title>
+<id>12</id>
+<revision>
+<id>345</id>
+<timestamp>2020-01-02T03:04:05Z</timestamp>
+<text xml:space="preserve">{{Infobox person|name=[[Bob]]|born=1900}}
+'''Bob''' is {{lang|en|x}}.</text>
+</revision>
+</page>
+</mediawiki>
+"""
+
+INFOBOXES = [('Infobox person', [('name', 'Bob'), ('born', '1900')])]
+
+
+##  TestInfoboxExtractor
+##
+class TestInfoboxExtractor(unittest.TestCase):
+
+    def test_tree(self):
+        # Infoboxes are taken from a parsed tree, also from inside
+        # other templates, but not from comments.
+        text = ("{{a|{{Infobox x|b = ''c''|d}}}}"
+                "<!-- {{Infobox y|e=f}} -->{{Infobox z|g=[[h|i]]}}")
+        parser = WikiTextParser()
+        parser.feed_text(text)
+        parser.close()
+        tree = parser.get_root()
+        extractor = mwwiki2txt.WikiInfoboxExtractor()
+        infoboxes = [('Infobox x', [('b', 'c'), ('1', 'd')]),
+                     ('Infobox z', [('g', 'i')])]
+        self.assertEqual(extractor.extract(tree), infoboxes)
+        self.assertEqual(extractor.extract(tree), infoboxes)
+        return
+
+
+##  TestXMLDump
+##
+class TestXMLDump(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.paths = [self.get_path('a.xml'), self.get_path('a.xml.bz2')]
+        with open(self.paths[0], 'w') as fp:
+            fp.write(DUMP)
+        with bz2.open(self.paths[1], 'wt') as fp:
+            fp.write(DUMP)
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+        return
+
+    def get_path(self, name):
+        return os.path.join(self.dirname, name)
+
+    def test_infoboxes(self):
+        for (i,path) in enumerate(self.paths):
+            output = self.get_path(f'text{i}.db')
+            mwwiki2txt.main(['mwwiki2txt.py', '-I', '-o', output, path])
+            db = WikiDB(output)
+            self.assertEqual(list(db), [(12, 'A')])
+            self.assertEqual(list(db[12]), [(345, '2020-01-02T03:04:05Z')])
+            self.assertEqual(db.get_content(345), ' Bob is .')
+            self.assertEqual(db.get_infoboxes(345), INFOBOXES)
+            db.close()
+        return
+
+    def test_templates(self):
+        for (i,path) in enumerate(self.paths):
+            output = self.get_path(f'tmpl{i}.db')
+            mwwiki2txt.main(['mwwiki2txt.py', '-X', '-o', output, path])
+            db = WikiDB(output)
+            templates = db.get_templates(345)
+            self.assertEqual([ t.name for t in templates ],
+                             ['Infobox person', 'Lang'])
+            self.assertEqual(list(db.find_templates('Infobox person', 'born')),
+                             [(12, 345, 0, 41)])
+            db.close()
+        return
+
+    def test_wiki(self):
+        # Infoboxes are taken in the same pass as the wiki text.
+        for (i,path) in enumerate(self.paths):
+            output = self.get_path(f'wiki{i}.db')
+            mwxml2wiki.main(['mwxml2wiki.py', '-I', '-o', output, path])
+            db = WikiDB(output)
+            self.assertIn('{{Infobox person', db.get_content(345))
+            self.assertEqual(db.get_infoboxes(345), INFOBOXES)
+            db.close()
+        return
+
+
+if __name__ == '__main__': unittest.main()
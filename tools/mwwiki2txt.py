@@ -2,32 +2,38 @@
 #
 # Usage examples:
 #  $ mwwiki2txt.py article12.wiki > article12.txt
+#  $ mwwiki2txt.py -S article12.wiki > article12.txt
 #  $ mwwiki2txt.py -L article12.wiki > article12.link
+#  $ mwwiki2txt.py -X -o jawiki.tmpl.db jawiki.xml.bz2
 #  $ mwwiki2txt.py -Z -o jawiki.txt.db jawiki.xml.bz2
+#  $ mwwiki2txt.py -I -Z -o jawiki.txt.db jawiki.xml.bz2
 #  $ mwwiki2txt.py -Z -o jawiki.txt.db jawiki.wiki.db
 #  $ mwwiki2txt.py -o all.txt.bz2 jawiki.xml.bz2
 #  $ mwwiki2txt.py -P 'article%(pageid)08d.txt' jawiki.xml.bz2
+#  $ mwwiki2txt.py -K jawiki.cache.db -Z -o jawiki.txt.db jawiki.wiki.db
+#  $ mwwiki2txt.py -B maxtime=10,maxnodes=1000000 -o jawiki.txt.db jawiki.xml.bz2
 #
 import re
 import sys
 import logging
 from pymwp.mwtokenizer import WikiToken
 from pymwp.mwtokenizer import XMLTagToken
-from pymwp.mwtokenizer import XMLEmptyTagToken
 from pymwp.mwparser import WikiTextParser
 from pymwp.mwparser import WikiTree
-from pymwp.mwparser import WikiXMLTree
 from pymwp.mwparser import WikiArgTree
-from pymwp.mwparser import WikiSpecialTree
-from pymwp.mwparser import WikiCommentTree
 from pymwp.mwparser import WikiKeywordTree
 from pymwp.mwparser import WikiLinkTree
-from pymwp.mwparser import WikiDivTree
-from pymwp.mwparser import WikiTableTree
-from pymwp.mwparser import WikiTableCellTree
 from pymwp.mwparser import WikiParserError
+from pymwp.mwparser import WikiParseProfile
+from pymwp.mwstream import WikiStreamParser
+from pymwp.mwtemplate import WikiTemplateParser
+from pymwp.mwtemplate import get_template_name
+from pymwp.mwtemplate import get_field_name
+from pymwp.mwvisitor import WikiVisitor
 from pymwp.mwxmldump import MWXMLDumpFilter
 from pymwp.mwdb import WikiDB
+from pymwp.mwcache import WikiParseCache
+from pymwp.mwsection import WikiParallelParser
 from pymwp.mwdb import WikiFileWriter
 from pymwp.utils import getfp
 
@@ -39,14 +45,98 @@ IGNORED = re.compile('^([-a-z]+|Category|Special):')
 def isignored(name): return IGNORED.match(name)
 
 
+##  WikiTextVisitor
+##
+##  The text of a tree, as WikiTextExtractor gives it.
+##
+class WikiTextVisitor(WikiVisitor):
+
+    def __init__(self):
+        self.texts = []
+        return
+
+    def get_text(self, nodes):
+        self.texts = []
+        for x in nodes:
+            self.visit(x)
+        return ''.join(self.texts)
+
+    def visit_WikiToken(self, token):
+        if token is WikiToken.PAR:
+            self.texts.append('\n')
+        else:
+            self.texts.append(rmsp(token.name))
+        return
+
+    def visit_XMLEmptyTagToken(self, token):
+        if token.name in XMLTagToken.BR_TAG:
+            self.texts.append('\n')
+        return
+
+    def visit_str(self, text):
+        self.texts.append(rmsp(text))
+        return
+
+    def visit_WikiSpecialTree(self, tree):
+        return
+
+    def visit_WikiCommentTree(self, tree):
+        return
+
+    def visit_WikiXMLTree(self, tree):
+        if tree.xml.name in XMLTagToken.NO_TEXT: return
+        yield from tree
+        if tree.xml.name in XMLTagToken.PAR_TAG:
+            self.texts.append('\n')
+        return
+
+    def visit_WikiKeywordTree(self, tree):
+        if tree:
+            if isinstance(tree[0], WikiTree):
+                name = tree[0].get_text()
+            else:
+                name = tree[0]
+            if isinstance(name, str) and not isignored(name):
+                yield tree[-1]
+        return
+
+    def visit_WikiLinkTree(self, tree):
+        if 2 <= len(tree):
+            for c in tree[1:]:
+                yield c
+                self.texts.append(' ')
+        elif tree:
+            yield tree[0]
+        return
+
+    def visit_WikiTableCellTree(self, tree):
+        if tree:
+            yield tree[-1]
+            self.texts.append('\n')
+        return
+
+    def visit_WikiTableTree(self, tree):
+        for c in tree:
+            if not isinstance(c, WikiArgTree):
+                yield c
+        return
+
+    def visit_WikiDivTree(self, tree):
+        yield from tree
+        self.texts.append('\n')
+        return
+
+
 ##  WikiTextExtractor
 ##
-class WikiTextExtractor(WikiTextParser):
+class WikiTextExtractor(WikiTextParser, WikiTextVisitor):
+
+    PARSER_ARGS = {}
 
-    def __init__(self, logger=None):
-        WikiTextParser.__init__(self)
+    def __init__(self, logger=None, **kwargs):
+        WikiTextParser.__init__(self, **self.PARSER_ARGS, **kwargs)
+        WikiTextVisitor.__init__(self)
         self.logger = logger
-        self.texts = []
         return
 
     def error(self, s):
@@ -60,72 +150,116 @@ class WikiTextExtractor(WikiTextParser):
 
     def close(self):
         WikiTextParser.close(self)
-        self.convert(self.get_root())
+        return self.extract(self.get_root())
+
+    def parse_tree(self, text):
+        self.feed_text(text)
+        WikiTextParser.close(self)
+        return self.get_root()
+
+    def extract(self, tree):
+        self.visit(tree)
         return ''.join(self.texts)
 
-    def convert(self, tree):
-        if tree is WikiToken.PAR:
-            self.texts.append('\n')
-        elif isinstance(tree, XMLEmptyTagToken):
-            if tree.name in XMLTagToken.BR_TAG:
-                self.texts.append('\n')
-        elif isinstance(tree, str):
-            self.texts.append(rmsp(tree))
-        elif isinstance(tree, WikiToken):
-            self.texts.append(rmsp(tree.name))
-        elif isinstance(tree, WikiSpecialTree):
-            pass
-        elif isinstance(tree, WikiCommentTree):
-            pass
-        elif isinstance(tree, WikiXMLTree):
-            if tree.xml.name in XMLTagToken.NO_TEXT:
-                pass
-            else:
-                for c in tree:
-                    self.convert(c)
-                if tree.xml.name in XMLTagToken.PAR_TAG:
-                    self.texts.append('\n')
-        elif isinstance(tree, WikiKeywordTree):
-            if tree:
-                if isinstance(tree[0], WikiTree):
-                    name = tree[0].get_text()
+
+##  WikiSkipTextExtractor
+##
+##  The content of NO_TEXT elements is not parsed at all (-S).
+##  Faster, but an unclosed <ref> drops the rest of the page.
+##
+class WikiSkipTextExtractor(WikiTextExtractor):
+
+    PARSER_ARGS = dict(skip_tags=XMLTagToken.NO_TEXT)
+
+
+##  WikiInfoboxExtractor
+##
+##  Infoboxes ({{Infobox ...}}, also inside other trees) of a
+##  parsed tree as [(name, [(key, value), ...]), ...]. Keys are
+##  normalized with get_field_name() and values are the text that
+##  WikiTextVisitor gives for them. Empty fields are not used.
+##
+class WikiInfoboxExtractor(WikiVisitor):
+
+    def __init__(self):
+        self.infoboxes = []
+        self._text = WikiTextVisitor()
+        return
+
+    def extract(self, tree):
+        self.infoboxes = []
+        self.visit(tree)
+        return self.infoboxes
+
+    def visit_WikiSpecialTree(self, tree):
+        self.add_infobox(tree)
+        return tree
+
+    def visit_WikiCommentTree(self, tree):
+        return
+
+    def add_infobox(self, tree):
+        fields = []
+        for arg in tree:
+            fields.append([])
+            for x in arg:
+                if x is WikiToken.TABLE_DATA or x is WikiToken.TABLE_DATA_SEP:
+                    # '|' at the beginning of a line and '||' are not
+                    # told apart from BAR by the tokenizer.
+                    fields.extend( [] for _ in x.name )
                 else:
-                    name = tree[0]
-                if isinstance(name, str) and not isignored(name):
-                    self.convert(tree[-1])
-        elif isinstance(tree, WikiLinkTree):
-            if 2 <= len(tree):
-                for c in tree[1:]:
-                    self.convert(c)
-                    self.texts.append(' ')
-            elif tree:
-                self.convert(tree[0])
-        elif isinstance(tree, WikiTableCellTree):
-            if tree:
-                self.convert(tree[-1])
-                self.texts.append('\n')
-        elif isinstance(tree, WikiTableTree):
-            for c in tree:
-                if not isinstance(c, WikiArgTree):
-                    self.convert(c)
-        elif isinstance(tree, WikiDivTree):
-            for c in tree:
-                self.convert(c)
-            self.texts.append('\n')
-        elif isinstance(tree, WikiTree):
-            for c in tree:
-                self.convert(c)
+                    fields[-1].append(x)
+        if not fields: return
+        name = get_template_name(self.get_text(fields[0]))
+        if name is None or not name.startswith('Infobox'): return
+        items = {}
+        n = 0
+        for nodes in fields[1:]:
+            (key, nodes) = self.split_field(nodes)
+            if key is None:
+                n += 1
+                key = str(n)
+            # A later field overrides an earlier one.
+            items[key] = self.get_text(nodes)
+        self.infoboxes.append(
+            (name, [ (k,v) for (k,v) in items.items() if k and v ]))
         return
 
+    def split_field(self, nodes):
+        # Returns the key and value of a named field, or None and
+        # the nodes. The key is before the first tree or tag.
+        for (i,x) in enumerate(nodes):
+            if isinstance(x, str):
+                (key, sep, value) = x.partition('=')
+                if sep:
+                    key = self.get_text(nodes[:i]+[key])
+                    return (get_field_name(key), [value]+nodes[i+1:])
+            elif isinstance(x, (WikiTree, XMLTagToken)):
+                break
+        return (None, nodes)
+
+    def get_text(self, nodes):
+        return self._text.get_text(nodes).strip()
+
 
 ##  WikiLinkExtractor
 ##
-class WikiLinkExtractor(WikiTextParser):
+##  Links are taken while parsing, without building a tree.
+##  Only the outermost [[...]] or [...] is reported; _args has
+##  a list of text parts (or a leaf) for each of its arguments.
+##
+class WikiLinkExtractor(WikiStreamParser):
 
-    def __init__(self, logger=None):
-        WikiTextParser.__init__(self)
+    PARSER_ARGS = {}
+
+    def __init__(self, logger=None, **kwargs):
+        WikiStreamParser.__init__(self, **self.PARSER_ARGS, **kwargs)
         self.logger = logger
+        self.kwargs = kwargs
         self.links = []
+        self._link = None
+        self._args = None
+        self._depth = 0
         return
 
     def error(self, s):
@@ -138,47 +272,75 @@ class WikiLinkExtractor(WikiTextParser):
         return
 
     def close(self):
-        WikiTextParser.close(self)
-        self.convert(self.get_root())
+        WikiStreamParser.close(self)
+        return self.links
+
+    def parse_tree(self, text):
+        # A tree is only built for the cache.
+        parser = WikiTextParser(**self.PARSER_ARGS, **self.kwargs)
+        parser.invalid_token = self.invalid_token
+        parser.feed_text(text)
+        parser.close()
+        self.exceeded = parser.exceeded
+        return parser.get_root()
+
+    def extract(self, tree):
+        self.feed_tree(tree)
         return self.links
 
-    def convert(self, tree):
+    def start_tree(self, tree):
+        if self._link is not None:
+            if self._depth == 0:
+                self._args.append([])
+            self._depth += 1
+        elif isinstance(tree, (WikiKeywordTree, WikiLinkTree)):
+            self._link = tree
+            self._args = []
+        return
+
+    def end_tree(self, tree):
+        if tree is self._link:
+            self.convert(tree, self._args)
+            self._link = self._args = None
+        elif self._link is not None:
+            self._depth -= 1
+        return
+
+    def handle_leaf(self, t):
+        if self._link is None:
+            pass
+        elif self._depth == 0:
+            self._args.append(t)
+        elif isinstance(t, str):
+            self._args[-1].append(t)
+        return
+
+    def convert(self, tree, args):
+        if not args: return
+        name = args[0]
+        if isinstance(name, list):
+            name = ''.join(name)
+        if not isinstance(name, str): return
         if isinstance(tree, WikiKeywordTree):
-            if tree:
-                if isinstance(tree[0], WikiTree):
-                    name = tree[0].get_text()
-                else:
-                    name = tree[0]
-                if isinstance(name, str):
-                    out = ('keyword', name)
-                    if 2 <= len(tree) and not isignored(name):
-                        text = tree[-1].get_text()
-                        out += (text,)
-                    self.links.append(out)
-        elif isinstance(tree, WikiLinkTree):
-            if tree:
-                if isinstance(tree[0], WikiTree):
-                    url = tree[0].get_text()
-                else:
-                    url = tree[0]
-                if isinstance(url, str):
-                    out = ('link', url)
-                    if 2 <= len(tree):
-                        text = tree[-1].get_text()
-                        out += (text,)
-                    self.links.append(out)
-        elif isinstance(tree, WikiTree):
-            for c in tree:
-                self.convert(c)
+            out = ('keyword', name)
+            if 2 <= len(args) and not isignored(name):
+                out += (''.join(args[-1]),)
+        else:
+            out = ('link', name)
+            if 2 <= len(args):
+                out += (''.join(args[-1]),)
+        self.links.append(out)
         return
 
 
 ##  WikiCategoryExtractor
 ##
-class WikiCategoryExtractor(WikiTextParser):
+class WikiCategoryExtractor(WikiTextParser, WikiVisitor):
+
+    PARSER_ARGS = dict(profile=WikiParseProfile.CATEGORIES)
 
-    def __init__(self, logger=None):
-        WikiTextParser.__init__(self)
+    def __init__(self, logger=None, **kwargs):
+        WikiTextParser.__init__(self, **self.PARSER_ARGS, **kwargs)
         self.logger = logger
         self.categories = []
         return
@@ -194,24 +356,55 @@ class WikiCategoryExtractor(WikiTextParser):
 
     def close(self):
         WikiTextParser.close(self)
-        self.convert(self.get_root())
+        return self.extract(self.get_root())
+
+    def parse_tree(self, text):
+        self.feed_text(text)
+        WikiTextParser.close(self)
+        return self.get_root()
+
+    def extract(self, tree):
+        self.visit(tree)
         return '\t'.join(self.categories)
 
-    def convert(self, tree):
-        if isinstance(tree, WikiKeywordTree):
-            if tree:
-                if isinstance(tree[0], WikiTree):
-                    name = tree[0].get_text()
-                else:
-                    name = tree[0]
-                if isinstance(name, str) and name.startswith('Category:'):
-                    self.categories.append(name)
-        elif isinstance(tree, WikiTree):
-            for c in tree:
-                self.convert(c)
+    def visit_WikiKeywordTree(self, tree):
+        if tree:
+            if isinstance(tree[0], WikiTree):
+                name = tree[0].get_text()
+            else:
+                name = tree[0]
+            if isinstance(name, str) and name.startswith('Category:'):
+                self.categories.append(name)
         return
 
 
+##  WikiTemplateExtractor
+##
+##  Templates need the source text, so there is no parse_tree().
+##
+class WikiTemplateExtractor(WikiTemplateParser):
+
+    PARSER_ARGS = {}
+
+    def __init__(self, logger=None, **kwargs):
+        WikiTemplateParser.__init__(self, **self.PARSER_ARGS, **kwargs)
+        self.logger = logger
+        return
+
+    def error(self, s):
+        if self.logger is not None:
+            self.logger.error(s)
+        return
+
+    def invalid_token(self, pos, token):
+        self.error(f'invalid token({pos}): {token!r}')
+        return
+
+    def close(self):
+        WikiTemplateParser.close(self)
+        return self.templates
+
+
 ##  MWDump2Text
 ##
 class MWDump2Text(MWXMLDumpFilter):
@@ -229,11 +422,12 @@ class MWDump2Text(MWXMLDumpFilter):
 
     def open_file(self, pageid, title, revid, timestamp):
         pageid = int(pageid)
-        revid = int(pageid)
-        return self._Stream(pageid, revid)
+        revid = int(revid)
+        return self._Stream(pageid, revid, timestamp)
 
     def close_file(self, fp):
-        self.converter.feed_text(fp.pageid, fp.revid, ''.join(fp.text))
+        text = ''.join(fp.text)
+        self.converter.feed_text(fp.pageid, fp.revid, fp.timestamp, text)
         return
 
     def write_file(self, fp, text):
@@ -241,9 +435,10 @@ class MWDump2Text(MWXMLDumpFilter):
         return
 
     class _Stream:
-        def __init__(self, pageid, revid):
+        def __init__(self, pageid, revid, timestamp):
             self.pageid = pageid
             self.revid = revid
+            self.timestamp = timestamp
             self.text = []
             return
 
@@ -252,13 +447,26 @@ class MWDump2Text(MWXMLDumpFilter):
 ##
 class Converter:
 
-    def __init__(self, writer, klass, logger=None):
+    def __init__(self, writer, klass, logger=None, cache=None, parallel=None,
+                 limits=None, infoboxes=False):
         self.writer = writer
         self.klass = klass
         self.logger = logger
+        self.cache = cache
+        self.parallel = parallel
+        self.limits = limits or {}
+        self.infoboxes = None
+        if infoboxes:
+            self.infoboxes = WikiInfoboxExtractor()
         return
 
     def close(self):
+        if self.parallel is not None:
+            self.parallel.close()
+        if self.cache is not None:
+            self.cache.close()
+            if self.logger is not None:
+                self.logger.info(f'cache: {self.cache!r}')
         return
 
     def error(self, s):
@@ -272,19 +480,70 @@ class Converter:
         return
 
     def feed_text(self, pageid, revid, timestamp, text):
-        parser = self.klass(logger=self.logger)
+        parser = self.klass(logger=self.logger, **self.limits)
         try:
-            parser.feed_text(text)
-            self.writer.add_content(pageid, revid, timestamp, parser.close())
+            if ((self.cache is None and self.parallel is None) or
+                not hasattr(parser, 'parse_tree')):
+                parser.feed_text(text)
+                content = parser.close()
+                tree = parser.get_root()
+            else:
+                tree = self.get_tree(parser, text)
+                content = parser.extract(tree)
+            self.check_limits(revid, parser)
+            self.add_content(pageid, revid, timestamp, content)
+            self.add_infoboxes(pageid, revid, timestamp, tree)
         except WikiParserError as e:
             self.error(f'error: {e!r}')
         return
 
+    def add_content(self, pageid, revid, timestamp, content):
+        if issubclass(self.klass, WikiTemplateExtractor):
+            self.writer.add_templates(pageid, revid, timestamp, content)
+        else:
+            self.writer.add_content(pageid, revid, timestamp, content)
+        return
+
+    def add_infoboxes(self, pageid, revid, timestamp, tree):
+        # Taken from the tree of the text, without parsing again.
+        if self.infoboxes is None: return
+        infoboxes = self.infoboxes.extract(tree)
+        self.writer.add_infoboxes(pageid, revid, timestamp, infoboxes)
+        return
+
+    def check_limits(self, revid, parser):
+        if parser.exceeded is not None and self.logger is not None:
+            self.logger.warning(f'revision {revid}: {parser.exceeded.limit}'
+                                f' exceeded at {parser.exceeded.pos}')
+        return
+
+    def get_tree(self, parser, text):
+        args = self.klass.PARSER_ARGS
+        if self.cache is not None:
+            tree = self.cache.get(text, **args)
+            if tree is not None: return tree
+        if self.parallel is not None:
+            tree = self.parallel.parse(text)
+            # Reported as the parser's.
+            parser.exceeded = self.parallel.exceeded
+        else:
+            tree = parser.parse_tree(text)
+        if self.cache is not None and parser.exceeded is None:
+            self.cache.put(text, tree, **args)
+        return tree
+
     def feed_file(self, pageid, revid, timestamp, fp):
-        parser = self.klass(logger=self.logger)
+        if ((self.cache is not None or self.parallel is not None) and
+            hasattr(self.klass, 'parse_tree')):
+            self.feed_text(pageid, revid, timestamp, fp.read())
+            return
+        parser = self.klass(logger=self.logger, **self.limits)
         try:
-            parser.feed_file(fp)
-            self.writer.add_content(pageid, revid, timestamp, parser.close())
+            parser.feed_file(fp, blocksize=65536)
+            content = parser.close()
+            self.check_limits(revid, parser)
+            self.add_content(pageid, revid, timestamp, content)
+            self.add_infoboxes(pageid, revid, timestamp, parser.get_root())
         except WikiParserError as e:
             self.error(f'error: {e!r}')
         return
@@ -293,11 +552,12 @@ class Converter:
 def main(argv):
     import getopt
     def usage():
-        print (f'usage: {argv[0]} [-L|-C] [-d] [-o output]'
-               ' [-P pathpat] [-c encoding] [-T] [-Z] [file ...]')
+        print (f'usage: {argv[0]} [-L|-C|-X|-S] [-I] [-d] [-o output]'
+               ' [-P pathpat] [-c encoding] [-K cachefile] [-j workers]'
+               ' [-B limit=value,...] [-T] [-Z] [file ...]')
         return 100
     try:
-        (opts, args) = getopt.getopt(argv[1:], 'LCdo:P:c:m:TZ')
+        (opts, args) = getopt.getopt(argv[1:], 'LCXSIdo:P:c:m:K:j:B:TZ')
     except getopt.GetoptError:
         return usage()
     args = args or ['-']
@@ -310,6 +570,10 @@ def main(argv):
     titleline = False
     gzipped = False
     klass = WikiTextExtractor
+    cachepath = None
+    workers = None
+    limits = None
+    infoboxes = False
     for (k, v) in opts:
         if k == '-d': level = logging.INFO
         elif k == '-o': output = v
@@ -318,8 +582,25 @@ def main(argv):
         elif k == '-m': mode = v
         elif k == '-T': titleline = True
         elif k == '-Z': gzipped = True
+        elif k == '-K': cachepath = v
+        elif k == '-j': workers = int(v)
+        elif k == '-B':
+            # e.g. -B maxtime=10,maxtokens=1000000
+            limits = dict(degrade=True)
+            for x in v.split(','):
+                (name,_,value) = x.partition('=')
+                if name not in ('maxtokens', 'maxnodes', 'maxtime'):
+                    return usage()
+                limits[name] = float(value) if name == 'maxtime' else int(value)
         elif k == '-L': klass = WikiLinkExtractor
         elif k == '-C': klass = WikiCategoryExtractor
+        elif k == '-X': klass = WikiTemplateExtractor
+        elif k == '-S': klass = WikiSkipTextExtractor
+        elif k == '-I': infoboxes = True
+    # Infoboxes go to the database, from the tree of the text.
+    if infoboxes and (not issubclass(klass, WikiTextExtractor) or
+                      not output.endswith('.db')):
+        return usage()
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=level)
 
     if output.endswith('.db'):
@@ -329,7 +610,16 @@ def main(argv):
             output=output, pathpat=pathpat,
             encoding=encoding, titleline=titleline, mode=mode)
     try:
-        converter = Converter(writer, klass, logger=logger)
+        cache = None
+        if cachepath is not None:
+            cache = WikiParseCache(path=cachepath, gzipped=gzipped)
+        parallel = None
+        if workers is not None:
+            parallel = WikiParallelParser(
+                workers=workers, **klass.PARSER_ARGS, **(limits or {}))
+        converter = Converter(writer, klass, logger=logger, cache=cache,
+                              parallel=parallel, limits=limits,
+                              infoboxes=infoboxes)
         for path in args:
             if path.endswith('.db'):
                 reader = WikiDB(path, gzipped=gzipped)
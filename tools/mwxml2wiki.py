@@ -3,6 +3,7 @@
 # Usage examples:
 #  $ mwxml2wiki.py -o all.wiki.gz jawiki.xml.bz2
 #  $ mwxml2wiki.py -Z -o jawiki.wiki.db jawiki.xml.bz2
+#  $ mwxml2wiki.py -I -Z -o jawiki.wiki.db jawiki.xml.bz2
 #  $ mwxml2wiki.py -P 'article%(pageid)08d.wiki' jawiki.xml.bz2
 #
 import sys
@@ -10,15 +11,20 @@ from pymwp.utils import getfp
 from pymwp.mwdb import WikiDB
 from pymwp.mwdb import WikiFileWriter
 from pymwp.mwxmldump import MWXMLDumpFilter
+from pymwp.mwparser import WikiTextParser
+from mwwiki2txt import WikiInfoboxExtractor
 
 
 ##  MWXMLDump2DB
 ##
 class MWXMLDump2DB(MWXMLDumpFilter):
 
-    def __init__(self, writer):
+    def __init__(self, writer, infoboxes=False):
         MWXMLDumpFilter.__init__(self)
         self.writer = writer
+        self.infoboxes = None
+        if infoboxes:
+            self.infoboxes = WikiInfoboxExtractor()
         return
 
     def close(self):
@@ -45,6 +51,15 @@ class MWXMLDump2DB(MWXMLDumpFilter):
     def close_file(self, fp):
         text = ''.join(fp.text)
         self.writer.add_content(fp.pageid, fp.revid, fp.timestamp, text)
+        if self.infoboxes is not None:
+            # Taken in the same pass as the text.
+            parser = WikiTextParser()
+            parser.invalid_token = (lambda pos, token: None)
+            parser.feed_text(text)
+            parser.close()
+            infoboxes = self.infoboxes.extract(parser.get_root())
+            self.writer.add_infoboxes(fp.pageid, fp.revid, fp.timestamp,
+                                      infoboxes)
         return
 
     def write_file(self, fp, text):
@@ -64,11 +79,11 @@ class MWXMLDump2DB(MWXMLDumpFilter):
 def main(argv):
     import getopt
     def usage():
-        print (f'usage: {argv[0]} [-o output] [-P pathpat] [-c encoding]'
+        print (f'usage: {argv[0]} [-I] [-o output] [-P pathpat] [-c encoding]'
                ' [-T] [-Z] [file ...]')
         return 100
     try:
-        (opts, args) = getopt.getopt(argv[1:], 'o:P:c:TZ')
+        (opts, args) = getopt.getopt(argv[1:], 'Io:P:c:TZ')
     except getopt.GetoptError:
         return usage()
     args = args or ['-']
@@ -77,19 +92,24 @@ def main(argv):
     pathpat = None
     titleline = False
     gzipped = False
+    infoboxes = False
     for (k, v) in opts:
-        if k == '-o': output = v
+        if k == '-I': infoboxes = True
+        elif k == '-o': output = v
         elif k == '-P': pathpat = v
         elif k == '-c': encoding = v
         elif k == '-T': titleline = True
         elif k == '-Z': gzipped = True
+    # Infoboxes go to the database.
+    if infoboxes and not output.endswith('.db'):
+        return usage()
     if output.endswith('.db'):
         writer = WikiDB(output, gzipped=gzipped)
     else:
         writer = WikiFileWriter(
             output=output, pathpat=pathpat,
             encoding=encoding, titleline=titleline)
-    parser = MWXMLDump2DB(writer)
+    parser = MWXMLDump2DB(writer, infoboxes=infoboxes)
     for path in args:
         (_,fp) = getfp(path)
         try: